@@ -1,33 +1,125 @@
+import asyncio
+import html
+import math
 from datetime import datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
-from sqlalchemy import func, select
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import and_, func, literal_column, or_, select, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.models.database import MealLog, get_session
+from app.models.database import (
+    ApiUsage,
+    Meal,
+    MealLog,
+    ScheduledPost,
+    User,
+    get_session,
+    meal_logs_fts,
+    read_session,
+    write_queue,
+)
 from app.models.schemas import (
     DailyMealInput,
     DailySummaryResponse,
+    DailyUsageResponse,
     HealthCheckResponse,
+    MealDayResponse,
     MealInput,
     MealLogResponse,
+    MealResponse,
+    MealSearchResult,
     MealType,
     PostResult,
+    ScheduledPostResponse,
+    UserCreate,
+    UserKeyResponse,
+    UserResponse,
+)
+from app.services.event_broadcaster import event_broadcaster
+from app.services.exporter import export_available, stream_meal_logs
+from app.services.image_maintenance import ensure_thumbnail
+from app.services.meal_processor import (
+    add_meal,
+    create_and_post,
+    daily_summary_fields,
+    daily_summary_query,
+    get_day_meals,
+    meal_log_fields,
+    process_single_meal,
+    remove_meal,
+    update_meal,
+)
+from app.services.openai_service import track_usage
+from app.services.post_scheduler import cancel_post, post_scheduler, schedule_post
+from app.services.profiler import request_profiler
+from app.services.rate_limiter import AdmissionRejectedError, admission_controller, rate_limiter
+from app.services.users import (
+    DEFAULT_USER_NAME,
+    can_post_to_instagram,
+    create_user,
+    rotate_api_key,
+    user_key_cache,
 )
-from app.services.meal_processor import create_and_post, process_single_meal
 
 router = APIRouter()
 
 
-async def verify_api_key(x_api_key: Annotated[str | None, Header()] = None):
-    """APIキー認証"""
-    if x_api_key != settings.secret_key:
+async def verify_api_key(x_api_key: Annotated[str | None, Header()] = None) -> int:
+    """APIキー認証（キーに対応するユーザーIDを返す）"""
+    user_id = await user_key_cache.authenticate(x_api_key)
+    if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key",
         )
+    return user_id
+
+
+async def verify_admin_key(x_admin_key: Annotated[str | None, Header()] = None):
+    """管理用キー認証（ADMIN_KEY が未設定の場合は管理用APIを無効化）"""
+    if not settings.admin_key:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin API is disabled (ADMIN_KEY is not set)",
+        )
+    if x_admin_key != settings.admin_key:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin key",
+        )
+
+
+async def admit_pipeline(user_id: int = Depends(verify_api_key)):
+    """重い処理（AI分析・画像生成・投稿）の流量制御（ユーザーIDを返す）
+
+    ユーザーごとのレート制限を超えた場合は429、同時実行枠と待ち行列が
+    埋まっている場合は503を Retry-After 付きで返す。
+    参照系のエンドポイントには適用しない。
+    """
+    wait = rate_limiter.consume(str(user_id))
+    if wait > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+    try:
+        await admission_controller.acquire()
+    except AdmissionRejectedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy",
+            headers={"Retry-After": str(e.retry_after)},
+        ) from None
+
+    try:
+        yield user_id
+    finally:
+        admission_controller.release()
 
 
 @router.get("/health", response_model=HealthCheckResponse)
@@ -36,14 +128,56 @@ async def health_check():
     return HealthCheckResponse(status="ok")
 
 
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    api_key: str | None = Query(None, description="APIキー（EventSourceはヘッダーを送れないため）"),
+    x_api_key: Annotated[str | None, Header()] = None,
+):
+    """ダッシュボード向けの変更イベント（Server-Sent Events）
+
+    - meal_log: 追加・更新された食事ログ
+    - day_totals: 更新された日の合計
+    - resync: イベントを取りこぼしたため再取得が必要
+    """
+    user_id = await verify_api_key(x_api_key or api_key)
+
+    async def event_stream():
+        queue = event_broadcaster.subscribe(user_id)
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    yield await asyncio.wait_for(
+                        queue.get(), timeout=settings.sse_keepalive_interval
+                    )
+                except TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            event_broadcaster.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/meal/analyze", response_model=PostResult)
 async def analyze_meal(
     meal: MealInput,
-    session: AsyncSession = Depends(get_session),
-    _: None = Depends(verify_api_key),
+    user_id: int = Depends(admit_pipeline),
 ):
     """単一の食事を分析（投稿なし）"""
-    pfc = await process_single_meal(meal)
+    with track_usage() as usage:
+        pfc = await process_single_meal(meal)
+
+    async def save_usage(write_session: AsyncSession) -> None:
+        for record in usage:
+            record.user_id = user_id
+        write_session.add_all(usage)
+
+    await write_queue.submit(save_usage)
     return PostResult(success=True, pfc=pfc)
 
 
@@ -51,11 +185,11 @@ async def analyze_meal(
 async def post_meal(
     daily_input: DailyMealInput,
     auto_post: bool = True,
-    session: AsyncSession = Depends(get_session),
-    _: None = Depends(verify_api_key),
+    publish_at: datetime | None = None,
+    user_id: int = Depends(admit_pipeline),
 ):
     """食事を処理してInstagramに投稿"""
-    result = await create_and_post(daily_input, session, auto_post=auto_post)
+    result = await create_and_post(daily_input, user_id, auto_post=auto_post, publish_at=publish_at)
     return result
 
 
@@ -63,8 +197,8 @@ async def post_meal(
 async def quick_post(
     description: str,
     auto_post: bool = True,
-    session: AsyncSession = Depends(get_session),
-    _: None = Depends(verify_api_key),
+    publish_at: datetime | None = None,
+    user_id: int = Depends(admit_pipeline),
 ):
     """
     簡易モード：テキストだけで投稿
@@ -75,7 +209,7 @@ async def quick_post(
         date=datetime.now(),
         total_description=description,
     )
-    result = await create_and_post(daily_input, session, auto_post=auto_post)
+    result = await create_and_post(daily_input, user_id, auto_post=auto_post, publish_at=publish_at)
     return result
 
 
@@ -85,8 +219,8 @@ async def shortcut_endpoint(
     description: str | None = None,
     image_base64: str | None = None,
     auto_post: bool = True,
-    session: AsyncSession = Depends(get_session),
-    _: None = Depends(verify_api_key),
+    publish_at: datetime | None = None,
+    user_id: int = Depends(admit_pipeline),
 ):
     """
     iPhoneショートカット用エンドポイント
@@ -95,6 +229,7 @@ async def shortcut_endpoint(
     - description: 食事の説明（任意）
     - image_base64: 写真のBase64（任意）
     - auto_post: 自動投稿するか（デフォルト: true）
+    - publish_at: 投稿時刻（省略時は次の空き時刻）
     """
     meal = MealInput(
         meal_type=meal_type,
@@ -105,64 +240,368 @@ async def shortcut_endpoint(
         date=datetime.now(),
         meals=[meal],
     )
-    result = await create_and_post(daily_input, session, auto_post=auto_post)
+    result = await create_and_post(daily_input, user_id, auto_post=auto_post, publish_at=publish_at)
     return result
 
 
+# 抜粋中の強調箇所の目印（HTMLエスケープしてから<mark>に置き換える）
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+
+def _mark_snippet(snippet: str) -> str:
+    """抜粋をHTMLエスケープし、目印を<mark>に置き換える（本文はユーザー・AIの入力のため）"""
+    return html.escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+def _highlight(log: MealLog, terms: list[str], width: int = 40) -> str:
+    """検索語の周辺を抜粋して<mark>で囲む（全文検索を使えない短い検索語用）"""
+    for value in (log.meal_description, log.ai_comment, log.caption):
+        positions = [value.find(term) for term in terms if value and term in value]
+        if not positions:
+            continue
+        start = max(min(positions) - width // 2, 0)
+        end = start + width
+        excerpt = value[start:end]
+        for term in terms:
+            excerpt = excerpt.replace(term, f"{MARK_START}{term}{MARK_END}")
+        excerpt = ("…" if start > 0 else "") + excerpt + ("…" if end < len(value) else "")
+        return _mark_snippet(excerpt)
+    return ""
+
+
+@router.get("/meal/search", response_model=list[MealSearchResult])
+async def search_meals(
+    q: str = Query(..., min_length=1, description="検索語（空白区切りでAND検索）"),
+    limit: int = Query(20, ge=1, le=100, description="取得件数"),
+    offset: int = Query(0, ge=0, description="開始位置"),
+    session: AsyncSession = Depends(get_session),
+    user_id: int = Depends(verify_api_key),
+):
+    """食事ログを全文検索（関連度順）"""
+    terms = q.split()
+
+    # trigramトークナイザは3文字以上の検索語のみインデックスで検索できる
+    if all(len(term) >= 3 for term in terms):
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        query = (
+            select(
+                MealLog,
+                literal_column("snippet(meal_logs_fts, -1, char(2), char(3), '…', 16)").label(
+                    "snippet"
+                ),
+            )
+            .join(meal_logs_fts, meal_logs_fts.c.rowid == MealLog.id)
+            .where(
+                text("meal_logs_fts MATCH :match").bindparams(match=match),
+                MealLog.user_id == user_id,
+            )
+            .order_by(text("bm25(meal_logs_fts)"))
+            .limit(limit)
+            .offset(offset)
+        )
+        result = await session.execute(query)
+        return [
+            MealSearchResult(**meal_log_fields(log), snippet=_mark_snippet(snippet or ""))
+            for log, snippet in result.all()
+        ]
+
+    query = (
+        select(MealLog)
+        .where(
+            MealLog.user_id == user_id,
+            and_(
+                *[
+                    or_(
+                        MealLog.meal_description.contains(term, autoescape=True),
+                        MealLog.ai_comment.contains(term, autoescape=True),
+                        MealLog.caption.contains(term, autoescape=True),
+                    )
+                    for term in terms
+                ]
+            ),
+        )
+        .order_by(MealLog.date.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+    result = await session.execute(query)
+    return [
+        MealSearchResult(**meal_log_fields(log), snippet=_highlight(log, terms))
+        for log in result.scalars().all()
+    ]
+
+
 @router.get("/meal/history", response_model=list[MealLogResponse])
 async def get_meal_history(
     start_date: str | None = Query(None, description="開始日 (YYYY-MM-DD)"),
     end_date: str | None = Query(None, description="終了日 (YYYY-MM-DD)"),
     session: AsyncSession = Depends(get_session),
-    _: None = Depends(verify_api_key),
+    user_id: int = Depends(verify_api_key),
 ):
     """食事ログの履歴を取得"""
-    query = select(MealLog).order_by(MealLog.date.desc())
+    query = select(MealLog).where(MealLog.user_id == user_id).order_by(MealLog.date.desc())
 
     if start_date:
         query = query.where(MealLog.date >= datetime.fromisoformat(start_date))
     if end_date:
-        query = query.where(
-            MealLog.date <= datetime.fromisoformat(end_date + "T23:59:59")
-        )
+        query = query.where(MealLog.date <= datetime.fromisoformat(end_date + "T23:59:59"))
 
     result = await session.execute(query)
     logs = result.scalars().all()
 
-    return [
-        MealLogResponse(
-            id=log.id,
-            date=log.date.strftime("%Y-%m-%d"),
-            protein=log.protein,
-            fat=log.fat,
-            carbs=log.carbs,
-            calories=log.calories,
-            meal_description=log.meal_description,
-            ai_comment=log.ai_comment,
-            mode=log.mode or "text_only",
+    return [MealLogResponse(**meal_log_fields(log)) for log in logs]
+
+
+async def _get_meal_log(session: AsyncSession, user_id: int, log_id: int) -> MealLog:
+    meal_log = await session.get(MealLog, log_id)
+    if meal_log is None or meal_log.user_id != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Meal log not found")
+    return meal_log
+
+
+def _day_response(day: tuple[MealLog, list[Meal]] | None) -> MealDayResponse:
+    if day is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Meal not found")
+    meal_log, meals = day
+
+    return MealDayResponse(
+        **meal_log_fields(meal_log),
+        meals=[
+            MealResponse(
+                id=meal.id,
+                meal_type=meal.meal_type,
+                description=meal.description,
+                protein=meal.protein,
+                fat=meal.fat,
+                carbs=meal.carbs,
+                calories=meal.calories,
+                comment=meal.comment,
+                has_image=meal.image_path is not None,
+            )
+            for meal in meals
+        ],
+    )
+
+
+@router.get("/meal/{log_id}/meals", response_model=MealDayResponse)
+async def get_day_meal_list(
+    log_id: int,
+    session: AsyncSession = Depends(get_session),
+    user_id: int = Depends(verify_api_key),
+):
+    """1日分の記録と食事一覧を取得"""
+    meal_log = await _get_meal_log(session, user_id, log_id)
+    return _day_response((meal_log, await get_day_meals(session, meal_log.id)))
+
+
+@router.get("/meal/{log_id}/thumbnail")
+async def get_thumbnail(
+    log_id: int,
+    session: AsyncSession = Depends(get_session),
+    user_id: int = Depends(verify_api_key),
+):
+    """ダッシュボード用のサムネイル画像を取得"""
+    meal_log = await _get_meal_log(session, user_id, log_id)
+    thumbnail_path = await ensure_thumbnail(meal_log)
+    if thumbnail_path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+    return FileResponse(
+        thumbnail_path,
+        media_type="image/webp",
+        headers={"Cache-Control": "private, max-age=86400"},
+    )
+
+
+@router.post("/meal/{log_id}/meals", response_model=MealDayResponse)
+async def add_day_meal(
+    log_id: int,
+    meal: MealInput,
+    user_id: int = Depends(admit_pipeline),
+):
+    """1日分の記録に食事を追加（追加した食事のみ分析し、合計をその日の食事から作り直す）"""
+    # AI処理中に読み取りトランザクションを保持しないよう、確認は短いセッションで行う
+    async with read_session() as session:
+        meal_log = await _get_meal_log(session, user_id, log_id)
+    return _day_response(await add_meal(user_id, meal_log.id, meal))
+
+
+@router.put("/meal/meals/{meal_id}", response_model=MealDayResponse)
+async def edit_day_meal(
+    meal_id: int,
+    meal: MealInput,
+    user_id: int = Depends(admit_pipeline),
+):
+    """食事を編集（その食事のみ再分析し、合計をその日の食事から作り直す）"""
+    return _day_response(await update_meal(user_id, meal_id, meal))
+
+
+@router.delete("/meal/meals/{meal_id}", response_model=MealDayResponse)
+async def delete_day_meal(
+    meal_id: int,
+    user_id: int = Depends(verify_api_key),
+):
+    """食事を削除（合計をその日の残りの食事から作り直す）"""
+    return _day_response(await remove_meal(user_id, meal_id))
+
+
+@router.post("/meal/{log_id}/schedule", response_model=ScheduledPostResponse)
+async def schedule_day_post(
+    log_id: int,
+    publish_at: datetime | None = None,
+    session: AsyncSession = Depends(get_session),
+    user_id: int = Depends(verify_api_key),
+):
+    """記録済みの内容でInstagram投稿を予約（publish_at 省略時は次の空き時刻）"""
+    if not can_post_to_instagram(user_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Instagram posting is disabled"
+        )
+    meal_log = await _get_meal_log(session, user_id, log_id)
+    if not meal_log.image_path:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No image to post")
+    if meal_log.caption is None:
+        # 食事を編集した後はキャプションを作り直す必要がある
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Caption is outdated; post the day again",
         )
-        for log in logs
+
+    async def job(write_session: AsyncSession) -> ScheduledPost:
+        return await schedule_post(write_session, log_id, publish_at)
+
+    scheduled = await write_queue.submit(job)
+    post_scheduler.notify(scheduled)
+    return ScheduledPostResponse.model_validate(scheduled, from_attributes=True)
+
+
+@router.get("/posts/scheduled", response_model=list[ScheduledPostResponse])
+async def list_scheduled_posts(
+    status_filter: Annotated[str | None, Query(alias="status")] = None,
+    limit: int = 50,
+    session: AsyncSession = Depends(get_session),
+    user_id: int = Depends(verify_api_key),
+):
+    """予約投稿の一覧（新しい予約時刻順）"""
+    query = (
+        select(ScheduledPost)
+        .join(MealLog, ScheduledPost.meal_log_id == MealLog.id)
+        .where(MealLog.user_id == user_id)
+        .order_by(ScheduledPost.publish_at.desc())
+        .limit(limit)
+    )
+    if status_filter:
+        query = query.where(ScheduledPost.status == status_filter)
+    result = await session.execute(query)
+    return [
+        ScheduledPostResponse.model_validate(scheduled, from_attributes=True)
+        for scheduled in result.scalars()
     ]
 
 
+@router.delete("/posts/scheduled/{scheduled_id}", response_model=ScheduledPostResponse)
+async def cancel_scheduled_post(
+    scheduled_id: int,
+    user_id: int = Depends(verify_api_key),
+):
+    """未投稿の予約を取り消す"""
+    scheduled = await cancel_post(user_id, scheduled_id)
+    if scheduled is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Scheduled post not found"
+        )
+    if scheduled.status != "cancelled":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Scheduled post is already {scheduled.status}",
+        )
+    return ScheduledPostResponse.model_validate(scheduled, from_attributes=True)
+
+
+EXPORT_MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def _export_response(
+    user_id: int, file_format: str, start_date: str | None, end_date: str | None
+) -> StreamingResponse:
+    if not export_available():
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail='Export requires pyarrow (pip install ".[export]")',
+        )
+
+    stream = stream_meal_logs(
+        user_id,
+        file_format,
+        start_date=datetime.fromisoformat(start_date) if start_date else None,
+        end_date=datetime.fromisoformat(end_date + "T23:59:59") if end_date else None,
+    )
+    return StreamingResponse(
+        stream,
+        media_type=EXPORT_MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="meal_logs.{file_format}"'},
+    )
+
+
+@router.get("/meal/export.parquet")
+async def export_parquet(
+    start_date: str | None = Query(None, description="開始日 (YYYY-MM-DD)"),
+    end_date: str | None = Query(None, description="終了日 (YYYY-MM-DD)"),
+    user_id: int = Depends(verify_api_key),
+):
+    """食事ログをParquet形式でエクスポート（zstd圧縮、ストリーミング）"""
+    return _export_response(user_id, "parquet", start_date, end_date)
+
+
+@router.get("/meal/export.arrow")
+async def export_arrow(
+    start_date: str | None = Query(None, description="開始日 (YYYY-MM-DD)"),
+    end_date: str | None = Query(None, description="終了日 (YYYY-MM-DD)"),
+    user_id: int = Depends(verify_api_key),
+):
+    """食事ログをArrow IPCストリーム形式でエクスポート（zstd圧縮、ストリーミング）"""
+    return _export_response(user_id, "arrow", start_date, end_date)
+
+
 @router.get("/meal/daily-summary", response_model=list[DailySummaryResponse])
 async def get_daily_summary(
     days: int = Query(30, description="取得する日数"),
     session: AsyncSession = Depends(get_session),
-    _: None = Depends(verify_api_key),
+    user_id: int = Depends(verify_api_key),
 ):
     """日別のPFCサマリーを取得"""
+    query = daily_summary_query(user_id).order_by(func.date(MealLog.date).desc()).limit(days)
+
+    result = await session.execute(query)
+    rows = result.all()
+
+    return [DailySummaryResponse(**daily_summary_fields(row)) for row in rows]
+
+
+@router.get("/usage/daily", response_model=list[DailyUsageResponse])
+async def get_daily_usage(
+    days: int = Query(30, description="取得する日数"),
+    session: AsyncSession = Depends(get_session),
+    user_id: int = Depends(verify_api_key),
+):
+    """日別のOpenAI API使用量とコストを取得"""
+    # created_at はUTCのため、食事の記録と同じローカル時刻の日付で集計する
+    usage_date = func.date(ApiUsage.created_at, "localtime")
     query = (
         select(
-            func.date(MealLog.date).label("date"),
-            func.sum(MealLog.protein).label("total_protein"),
-            func.sum(MealLog.fat).label("total_fat"),
-            func.sum(MealLog.carbs).label("total_carbs"),
-            func.sum(MealLog.calories).label("total_calories"),
-            func.count(MealLog.id).label("meal_count"),
+            usage_date.label("date"),
+            func.count(ApiUsage.id).label("request_count"),
+            func.sum(ApiUsage.prompt_tokens).label("prompt_tokens"),
+            func.sum(ApiUsage.cached_tokens).label("cached_tokens"),
+            func.sum(ApiUsage.completion_tokens).label("completion_tokens"),
+            func.sum(ApiUsage.cost_usd).label("cost_usd"),
         )
-        .group_by(func.date(MealLog.date))
-        .order_by(func.date(MealLog.date).desc())
+        .where(ApiUsage.user_id == user_id)
+        .group_by(usage_date)
+        .order_by(usage_date.desc())
         .limit(days)
     )
 
@@ -170,13 +609,98 @@ async def get_daily_summary(
     rows = result.all()
 
     return [
-        DailySummaryResponse(
+        DailyUsageResponse(
             date=str(row.date),
-            total_protein=row.total_protein or 0,
-            total_fat=row.total_fat or 0,
-            total_carbs=row.total_carbs or 0,
-            total_calories=row.total_calories or 0,
-            meal_count=row.meal_count,
+            request_count=row.request_count,
+            prompt_tokens=row.prompt_tokens or 0,
+            cached_tokens=row.cached_tokens or 0,
+            completion_tokens=row.completion_tokens or 0,
+            cost_usd=round(row.cost_usd or 0, 6),
         )
         for row in rows
     ]
+
+
+@router.post("/admin/users", response_model=UserKeyResponse)
+async def create_api_user(body: UserCreate, _: None = Depends(verify_admin_key)):
+    """ユーザーを作成してAPIキーを発行"""
+    created = await create_user(body.name)
+    if created is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="User already exists")
+    user, api_key = created
+    return UserKeyResponse(id=user.id, name=user.name, created_at=user.created_at, api_key=api_key)
+
+
+@router.get("/admin/users", response_model=list[UserResponse])
+async def list_users(
+    session: AsyncSession = Depends(get_session),
+    _: None = Depends(verify_admin_key),
+):
+    """ユーザーの一覧"""
+    result = await session.execute(select(User).order_by(User.id))
+    return [
+        UserResponse(id=user.id, name=user.name, created_at=user.created_at)
+        for user in result.scalars()
+    ]
+
+
+@router.post("/admin/users/{target_user_id}/rotate-key", response_model=UserKeyResponse)
+async def rotate_user_key(
+    target_user_id: int,
+    session: AsyncSession = Depends(get_session),
+    _: None = Depends(verify_admin_key),
+):
+    """APIキーを再発行（以前のキーはすぐに使えなくなる）"""
+    user = await session.get(User, target_user_id)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    if user.name == DEFAULT_USER_NAME:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The default user's key is SECRET_KEY; change it in the environment",
+        )
+    user, api_key = await rotate_api_key(target_user_id)
+    return UserKeyResponse(id=user.id, name=user.name, created_at=user.created_at, api_key=api_key)
+
+
+def _get_profile_record(record_id: int) -> dict:
+    record = request_profiler.get(record_id)
+    if record is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return record
+
+
+@router.get("/admin/profiles")
+async def list_profiles(_: None = Depends(verify_admin_key)):
+    """記録した遅いリクエスト・プロファイルの一覧（新しい順）"""
+    return [
+        {key: value for key, value in record.items() if key not in ("timeline", "folded")}
+        for record in reversed(request_profiler.records)
+    ]
+
+
+@router.get("/admin/profiles/{record_id}")
+async def get_profile(record_id: int, _: None = Depends(verify_admin_key)):
+    """プロファイルの詳細（タイムラインを含む）"""
+    record = _get_profile_record(record_id)
+    return {key: value for key, value in record.items() if key != "folded"}
+
+
+@router.get("/admin/profiles/{record_id}/folded", response_class=PlainTextResponse)
+async def get_profile_folded(record_id: int, _: None = Depends(verify_admin_key)):
+    """flamegraph.pl / speedscope 用の collapsed stack 形式"""
+    record = _get_profile_record(record_id)
+    if not record["profiled"]:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Request was not profiled"
+        )
+    return record["folded"]
+
+
+@router.get("/admin/loop-lag")
+async def get_loop_lag(_: None = Depends(verify_admin_key)):
+    """イベントループ遅延の計測値（ミリ秒）"""
+    return [
+        {"at": datetime.fromtimestamp(at).isoformat(), "lag_ms": lag}
+        for at, lag in request_profiler.loop_lag.samples
+    ]
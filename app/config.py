@@ -13,17 +13,60 @@ class Settings(BaseSettings):
     instagram_username: str = ""
     instagram_password: str = ""
     instagram_enabled: bool = False  # Instagram投稿を有効にするかどうか
+    instagram_post_interval: int = 900  # 投稿の最小間隔（秒）
+    instagram_retry_delay: int = 600  # 投稿に失敗した場合の再試行までの時間（秒）
+    instagram_max_attempts: int = 3  # 投稿の最大試行回数
 
     # Server
     host: str = "0.0.0.0"
     port: int = 8000
     secret_key: str = "change-me-in-production"
+    admin_key: str = ""  # 管理用キー（未設定の場合は管理用APIとX-Profileを無効化）
+
+    # 流量制御（AI分析・画像生成・投稿などの重い処理）
+    max_concurrent_pipelines: int = 2  # 同時に実行する処理の上限
+    pipeline_queue_size: int = 4  # 空きを待てるリクエスト数
+    pipeline_queue_timeout: float = 10.0  # 待機の上限（秒）
+    pipeline_retry_after: int = 30  # 混雑時に返すRetry-After（秒）
+    rate_limit_per_minute: float = 6.0  # APIキーごとの補充レート
+    rate_limit_burst: int = 5  # APIキーごとの最大バースト
+
+    # リクエストのプロファイリング（X-Profile: <管理用キー> ヘッダー、またはサンプリング）
+    profile_sample_rate: float = 0.0  # 0.0〜1.0
+    profile_interval: float = 0.005  # スタックの採取間隔（秒）
+    profile_history_size: int = 20  # 保存するリクエスト数
+    slow_request_threshold_ms: float = 5000.0  # これより遅いリクエストは記録する
+    loop_lag_interval: float = 0.5  # イベントループ遅延の計測間隔（秒）
+
+    # ダッシュボードへのイベント配信（SSE）
+    sse_buffer_size: int = 32  # クライアントごとに溜めるイベント数の上限
+    sse_keepalive_interval: float = 15.0  # 無通信時のkeepalive間隔（秒）
 
     # Paths
     images_dir: Path = Path("./images")
     data_dir: Path = Path("/data")  # Railway Volume用（本番）
     database_url: str | None = None  # 環境変数で上書き可能
 
+    # レスポンス圧縮
+    compression_minimum_size: int = 1024  # これ未満のAPIレスポンスは圧縮しない
+
+    # SQLite
+    db_busy_timeout_ms: int = 5000
+    db_mmap_size: int = 256 * 1024 * 1024
+    db_cache_size_kb: int = 64 * 1024
+    db_read_pool_size: int = 5  # 読み取り専用の接続数
+    db_write_batch_size: int = 32  # 1トランザクションでまとめてコミットする書き込み数
+
+    # 画像の保存期間・容量管理（バックグラウンドで定期実行）
+    image_maintenance_enabled: bool = True
+    image_maintenance_interval: int = 3600  # 実行間隔（秒）
+    image_maintenance_throttle: float = 0.2  # 1ファイルごとの待機（秒）
+    image_transcode_after_days: int = 30  # この日数より古い画像を変換
+    image_transcode_format: str = "WEBP"  # WEBP / AVIF
+    image_transcode_quality: int = 60
+    thumbnail_size: int = 320  # サムネイルの長辺（px）
+    images_quota_mb: int = 2048  # 超えた場合は古い画像から削除（サムネイルは残す）
+
     @property
     def db_url(self) -> str:
         """データベースURLを取得（環境変数 > data_dir > デフォルト）"""
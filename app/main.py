@@ -1,14 +1,18 @@
+import asyncio
 from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
 
 from app.api.routes import router
 from app.config import settings
-from app.models.database import init_db
+from app.models.database import close_db, init_db, write_queue
+from app.services.compression import CompressionMiddleware, static_assets
+from app.services.image_maintenance import image_maintenance_loop
+from app.services.post_scheduler import post_scheduler
+from app.services.profiler import ProfilingMiddleware, request_profiler
+from app.services.users import ensure_default_user
 
 
 @asynccontextmanager
@@ -16,9 +20,21 @@ async def lifespan(app: FastAPI):
     """アプリケーションのライフサイクル管理"""
     # Startup
     await init_db()
+    await asyncio.to_thread(static_assets.build, STATIC_DIR)
+    write_queue.start()
+    await ensure_default_user()
+    await post_scheduler.start()
+    loop_lag_task = asyncio.create_task(request_profiler.loop_lag.run())
+    maintenance_task = None
+    if settings.image_maintenance_enabled:
+        maintenance_task = asyncio.create_task(image_maintenance_loop())
     yield
     # Shutdown
-    pass
+    loop_lag_task.cancel()
+    if maintenance_task is not None:
+        maintenance_task.cancel()
+    await post_scheduler.stop()
+    await close_db()
 
 
 app = FastAPI(
@@ -37,6 +53,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 一定サイズ以上のAPIレスポンスを圧縮
+app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_minimum_size)
+
+# 遅いリクエストの記録・プロファイリング
+app.add_middleware(ProfilingMiddleware)
+
 # ルーター登録
 app.include_router(router, prefix="/api/v1")
 
@@ -45,9 +67,9 @@ STATIC_DIR = Path(__file__).parent / "static"
 
 
 @app.get("/")
-async def root():
+async def root(request: Request):
     """フロントエンドページを表示"""
-    return FileResponse(STATIC_DIR / "index.html")
+    return static_assets.response("index.html", request)
 
 
 @app.get("/api")
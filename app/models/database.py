@@ -1,6 +1,23 @@
+import asyncio
+from collections.abc import Awaitable, Callable
 from datetime import datetime
+from typing import TypeVar
 
-from sqlalchemy import Column, DateTime, Float, Integer, String, Text
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    column,
+    event,
+    inspect,
+    table,
+    text,
+)
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
 
@@ -11,13 +28,27 @@ class Base(DeclarativeBase):
     pass
 
 
+class User(Base):
+    """ユーザー（APIキーはハッシュのみ保存）"""
+
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    name = Column(String(100), nullable=False, unique=True)
+    api_key_hash = Column(String(64), nullable=False, unique=True)
+
+
 class MealLog(Base):
     """食事ログのDBモデル"""
 
     __tablename__ = "meal_logs"
+    __table_args__ = (Index("ix_meal_logs_user_id_date", "user_id", "date"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # 既存の記録は起動時にデフォルトユーザーに割り当てる
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     date = Column(DateTime, nullable=False)
 
     # PFC データ
@@ -34,23 +65,307 @@ class MealLog(Base):
     instagram_post_id = Column(String(100), nullable=True)
     caption = Column(Text, nullable=True)
     image_path = Column(String(500), nullable=True)
+    thumbnail_path = Column(String(500), nullable=True)
 
     # モード（photo / text_only）
     mode = Column(String(20), default="text_only")
 
 
+class Meal(Base):
+    """1食ごとのDBモデル（MealLogが1日分の記録、合計値は食事から計算し直す）"""
+
+    __tablename__ = "meals"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    meal_log_id = Column(Integer, ForeignKey("meal_logs.id"), nullable=False, index=True)
+
+    # 食事タイプ（breakfast / lunch / dinner / snack、簡易モードはNone）
+    meal_type = Column(String(20), nullable=True)
+    description = Column(Text, nullable=True)
+    image_path = Column(String(500), nullable=True)
+
+    # PFC データ
+    protein = Column(Float, nullable=False)
+    fat = Column(Float, nullable=False)
+    carbs = Column(Float, nullable=False)
+    calories = Column(Float, nullable=False)
+    comment = Column(Text, nullable=True)
+
+    # 分析結果の再利用キー（食事タイプ・説明・写真のハッシュ）
+    cache_key = Column(String(64), nullable=False, index=True)
+
+
+class ApiUsage(Base):
+    """OpenAI API呼び出しごとのトークン使用量"""
+
+    __tablename__ = "api_usage"
+    __table_args__ = (Index("ix_api_usage_user_id_created_at", "user_id", "created_at"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # UTC
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    meal_log_id = Column(Integer, ForeignKey("meal_logs.id"), nullable=True)
+
+    # 呼び出し内容（pfc / pfc_batch / caption / image）
+    task = Column(String(20), nullable=False)
+    model = Column(String(50), nullable=False)
+
+    # トークン使用量（response.usage）
+    prompt_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+
+    # 推定コスト（USD）
+    cost_usd = Column(Float, default=0.0)
+
+
+class ScheduledPost(Base):
+    """Instagramへの予約投稿（投稿時点のMealLogのキャプション・画像を使う）"""
+
+    __tablename__ = "scheduled_posts"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    meal_log_id = Column(Integer, ForeignKey("meal_logs.id"), nullable=False, index=True)
+    publish_at = Column(DateTime, nullable=False, index=True)
+
+    # 状態（pending / posting / posted / failed / cancelled）
+    status = Column(String(20), nullable=False, default="pending", index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    posted_at = Column(DateTime, nullable=True)
+    post_id = Column(String(100), nullable=True)
+    error = Column(Text, nullable=True)
+
+
+T = TypeVar("T")
+
+
+def _read_only_url(url: str) -> str | None:
+    """SQLiteファイルを読み取り専用で開くURL（インメモリの場合は None）"""
+    prefix = "sqlite+aiosqlite:///"
+    path = url.removeprefix(prefix)
+    if not url.startswith(prefix) or not path or path == ":memory:" or path.startswith("file:"):
+        return None
+    return f"{prefix}file:{path}?mode=ro&uri=true"
+
+
+def _configure_sqlite(engine, begin_sql: str, read_only: bool = False) -> None:
+    """接続ごとのPRAGMAと、トランザクション開始方法を設定"""
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        # pysqlite の暗黙のBEGINを無効にし、BEGINは "begin" イベントで発行する
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={settings.db_busy_timeout_ms}")
+        cursor.execute(f"PRAGMA mmap_size={settings.db_mmap_size}")
+        cursor.execute(f"PRAGMA cache_size=-{settings.db_cache_size_kb}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def on_begin(conn):
+        conn.exec_driver_sql(begin_sql)
+
+
 # Database engine and session
-engine = create_async_engine(settings.db_url, echo=False)
+_read_url = _read_only_url(settings.db_url)
+if _read_url is not None:
+    # 書き込み用（WriteQueue の1タスクのみが使用。開始時に書き込みロックを取る）
+    engine = create_async_engine(settings.db_url, echo=False, pool_size=1, max_overflow=0)
+    # 読み取り専用（リクエスト処理で使用）
+    read_engine = create_async_engine(
+        _read_url, echo=False, pool_size=settings.db_read_pool_size, max_overflow=0
+    )
+    _configure_sqlite(engine, "BEGIN IMMEDIATE")
+    _configure_sqlite(read_engine, "BEGIN", read_only=True)
+else:
+    # インメモリなどは既定のプール（1接続を共有するStaticPool）で読み書きとも同じエンジンを使う
+    engine = read_engine = create_async_engine(settings.db_url, echo=False)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+read_session = async_sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+class WriteQueue:
+    """SQLiteへの書き込みを1つのタスクに集約し、溜まった書き込みをまとめてコミットする
+
+    書き込みは `job(session)` の形で渡す。同時に待っている書き込みは1トランザクションで
+    処理し、それぞれSAVEPOINTで分離するため、失敗した書き込みだけがロールバックされる。
+    """
+
+    def __init__(self, max_batch: int):
+        self._max_batch = max_batch
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        # 受付済みの書き込みを処理してから停止
+        await self._queue.join()
+        self._task.cancel()
+        self._task = None
+
+    async def submit(self, job: Callable[[AsyncSession], Awaitable[T]]) -> T:
+        """書き込みを実行し、コミット後に job の戻り値を返す"""
+        if self._task is None:
+            # キューが動いていない場合（スクリプト等）はその場で実行
+            async with async_session() as session:
+                result = await job(session)
+                await session.commit()
+                return result
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, future))
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            jobs = [await self._queue.get()]
+            while len(jobs) < self._max_batch and not self._queue.empty():
+                jobs.append(self._queue.get_nowait())
+
+            results = []
+            try:
+                async with async_session() as session:
+                    for job, future in jobs:
+                        try:
+                            async with session.begin_nested():
+                                results.append((future, await job(session), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+                    await session.commit()
+            except Exception as e:
+                results = [(future, None, e) for _, future in jobs]
+
+            for future, result, error in results:
+                if future.cancelled():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+            for _ in jobs:
+                self._queue.task_done()
+
+
+# Singleton instance
+write_queue = WriteQueue(max_batch=settings.db_write_batch_size)
+
+
+def _add_missing_columns(conn) -> None:
+    """既存のテーブルに不足しているカラムを追加（簡易マイグレーション）"""
+    inspector = inspect(conn)
+    for model_table in Base.metadata.sorted_tables:
+        existing = {info["name"] for info in inspector.get_columns(model_table.name)}
+        for model_column in model_table.columns:
+            if model_column.name not in existing:
+                column_type = model_column.type.compile(conn.dialect)
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {model_table.name} "
+                        f"ADD COLUMN {model_column.name} {column_type}"
+                    )
+                )
+
+
+def _create_missing_indexes(conn) -> None:
+    """既存のテーブルに不足しているインデックスを作成"""
+    for model_table in Base.metadata.sorted_tables:
+        for index in model_table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+# 食事ログの全文検索インデックス（日本語向けにtrigramトークナイザを使用）
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS meal_logs_fts USING fts5(
+        meal_description, ai_comment, caption,
+        content='meal_logs', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS meal_logs_fts_insert AFTER INSERT ON meal_logs BEGIN
+        INSERT INTO meal_logs_fts(rowid, meal_description, ai_comment, caption)
+        VALUES (new.id, new.meal_description, new.ai_comment, new.caption);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS meal_logs_fts_delete AFTER DELETE ON meal_logs BEGIN
+        INSERT INTO meal_logs_fts(meal_logs_fts, rowid, meal_description, ai_comment, caption)
+        VALUES ('delete', old.id, old.meal_description, old.ai_comment, old.caption);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS meal_logs_fts_update
+    AFTER UPDATE OF meal_description, ai_comment, caption ON meal_logs BEGIN
+        INSERT INTO meal_logs_fts(meal_logs_fts, rowid, meal_description, ai_comment, caption)
+        VALUES ('delete', old.id, old.meal_description, old.ai_comment, old.caption);
+        INSERT INTO meal_logs_fts(rowid, meal_description, ai_comment, caption)
+        VALUES (new.id, new.meal_description, new.ai_comment, new.caption);
+    END
+    """,
+]
+
+
+# 全文検索インデックス（クエリ用）
+meal_logs_fts = table("meal_logs_fts", column("rowid"))
+
+
+def _create_search_index(conn) -> None:
+    """全文検索インデックスとトリガーを作成（初回は既存の記録から構築）"""
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meal_logs_fts'")
+    ).first()
+    for ddl in SEARCH_INDEX_DDL:
+        conn.execute(text(ddl))
+    if not exists:
+        conn.execute(text("INSERT INTO meal_logs_fts(meal_logs_fts) VALUES ('rebuild')"))
+
+
+# 食事単位の記録がない過去の記録を1件の食事として移行
+ADOPT_LEGACY_MEALS_SQL = """
+INSERT INTO meals (
+    created_at, meal_log_id, meal_type, description, image_path,
+    protein, fat, carbs, calories, comment, cache_key
+)
+SELECT
+    l.created_at, l.id, NULL, l.meal_description,
+    CASE WHEN l.mode = 'photo' THEN l.image_path END,
+    l.protein, l.fat, l.carbs, l.calories, l.ai_comment, 'meal_log:' || l.id
+FROM meal_logs l
+WHERE (l.protein > 0 OR l.fat > 0 OR l.carbs > 0 OR l.calories > 0)
+  AND NOT EXISTS (SELECT 1 FROM meals m WHERE m.meal_log_id = l.id)
+"""
 
 
 async def init_db():
     """データベースを初期化"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+        await conn.run_sync(_create_search_index)
+        await conn.execute(text(ADOPT_LEGACY_MEALS_SQL))
+
+
+async def close_db():
+    """データベース接続を閉じる"""
+    await write_queue.stop()
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
 
 
 async def get_session() -> AsyncSession:
-    """セッションを取得"""
-    async with async_session() as session:
+    """読み取り用のセッションを取得（書き込みは write_queue を使う）"""
+    async with read_session() as session:
         yield session
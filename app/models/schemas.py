@@ -50,6 +50,8 @@ class PostResult(BaseModel):
     caption: str | None = None
     pfc: PFCData | None = None
     error: str | None = None
+    scheduled_post_id: int | None = Field(default=None, description="予約投稿のID")
+    scheduled_at: datetime | None = Field(default=None, description="投稿予定時刻")
 
 
 class MealLogResponse(BaseModel):
@@ -64,6 +66,35 @@ class MealLogResponse(BaseModel):
     meal_description: str | None = None
     ai_comment: str | None = None
     mode: str = "text_only"
+    has_image: bool = False
+
+
+class MealSearchResult(MealLogResponse):
+    """全文検索の結果"""
+
+    snippet: str = Field(
+        default="", description="一致箇所を<mark>で囲んだ抜粋（HTMLエスケープ済み）"
+    )
+
+
+class MealResponse(BaseModel):
+    """1食分のレスポンス"""
+
+    id: int
+    meal_type: str | None = None
+    description: str | None = None
+    protein: float
+    fat: float
+    carbs: float
+    calories: float
+    comment: str | None = None
+    has_image: bool = False
+
+
+class MealDayResponse(MealLogResponse):
+    """1日分の記録と食事一覧のレスポンス"""
+
+    meals: list[MealResponse] = Field(default_factory=list)
 
 
 class DailySummaryResponse(BaseModel):
@@ -77,6 +108,50 @@ class DailySummaryResponse(BaseModel):
     meal_count: int
 
 
+class DailyUsageResponse(BaseModel):
+    """日別のAPI使用量・コストのレスポンス"""
+
+    date: str
+    request_count: int
+    prompt_tokens: int
+    cached_tokens: int
+    completion_tokens: int
+    cost_usd: float
+
+
+class ScheduledPostResponse(BaseModel):
+    """予約投稿"""
+
+    id: int
+    meal_log_id: int
+    publish_at: datetime
+    status: str
+    attempts: int
+    posted_at: datetime | None = None
+    post_id: str | None = None
+    error: str | None = None
+
+
+class UserCreate(BaseModel):
+    """ユーザー作成"""
+
+    name: str = Field(..., min_length=1, max_length=100)
+
+
+class UserResponse(BaseModel):
+    """ユーザー"""
+
+    id: int
+    name: str
+    created_at: datetime | None = None
+
+
+class UserKeyResponse(UserResponse):
+    """発行したAPIキー（この時だけ返す）"""
+
+    api_key: str
+
+
 class HealthCheckResponse(BaseModel):
     status: str
     version: str = "0.1.0"
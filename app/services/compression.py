@@ -0,0 +1,186 @@
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+
+import brotli
+from fastapi import Request
+from fastapi.responses import Response
+
+# 圧縮して効果のあるContent-Type
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+# Base64画像を含むレスポンス（圧縮してもほとんど小さくならない）
+IMAGE_PAYLOAD_MARKER = b'"image_base64":"'
+
+# 静的ファイルは起動時に1回だけ圧縮するため最大圧縮、APIレスポンスは速度優先
+STATIC_BROTLI_QUALITY = 11
+STATIC_GZIP_LEVEL = 9
+DYNAMIC_BROTLI_QUALITY = 4
+DYNAMIC_GZIP_LEVEL = 5
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str | None:
+    """Accept-Encoding から使用する圧縮方式を選択（br > gzip）"""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if params in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def _compress(data: bytes, encoding: str, static: bool = False) -> bytes:
+    if encoding == "br":
+        quality = STATIC_BROTLI_QUALITY if static else DYNAMIC_BROTLI_QUALITY
+        return brotli.compress(data, quality=quality)
+    level = STATIC_GZIP_LEVEL if static else DYNAMIC_GZIP_LEVEL
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class StaticAsset:
+    """静的ファイルの内容と、事前に圧縮した版"""
+
+    def __init__(self, path: Path):
+        self.content = path.read_bytes()
+        self.media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.etag = hashlib.sha256(self.content).hexdigest()[:16]
+        self.variants: dict[str, bytes] = {}
+        if self.media_type in COMPRESSIBLE_TYPES:
+            for encoding in ("br", "gzip"):
+                compressed = _compress(self.content, encoding, static=True)
+                if len(compressed) < len(self.content):
+                    self.variants[encoding] = compressed
+
+
+class StaticAssets:
+    """静的ファイルを起動時に読み込み・圧縮して、メモリから配信する"""
+
+    def __init__(self):
+        self._assets: dict[str, StaticAsset] = {}
+
+    def build(self, directory: Path) -> None:
+        self._assets = {
+            path.relative_to(directory).as_posix(): StaticAsset(path)
+            for path in sorted(directory.rglob("*"))
+            if path.is_file()
+        }
+
+    def response(self, name: str, request: Request) -> Response:
+        """圧縮方式を選んで配信（毎回ETagで再検証させ、一致すれば304）"""
+        asset = self._assets.get(name)
+        if asset is None:
+            return Response(status_code=404)
+
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        if encoding not in asset.variants:
+            encoding = None
+        etag = f'"{asset.etag}-{encoding}"' if encoding else f'"{asset.etag}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
+        return Response(asset.content, media_type=asset.media_type, headers=headers)
+
+
+class CompressionMiddleware:
+    """一定サイズ以上のAPIレスポンスを圧縮するASGIミドルウェア
+
+    ストリーミングレスポンス（SSE・エクスポート）、圧縮済みのレスポンス、
+    Base64画像を含むレスポンスはそのまま返す。
+    """
+
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept_encoding)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"").split(b";")[0].decode("latin-1")
+                if b"content-encoding" in headers or content_type not in COMPRESSIBLE_TYPES:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or IMAGE_PAYLOAD_MARKER in body
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = _compress(body, encoding)
+            headers = []
+            vary = [b"Accept-Encoding"]
+            for name, value in start_message.get("headers", []):
+                if name.lower() == b"vary":
+                    vary.insert(0, value)
+                elif name.lower() != b"content-length":
+                    headers.append((name, value))
+            headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(compressed)).encode("latin-1")),
+                (b"vary", b", ".join(vary)),
+            ]
+            await send({**start_message, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# Singleton instance
+static_assets = StaticAssets()
@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+from app.config import settings
+
+# バッファが溢れたクライアントに送る再取得の指示
+RESYNC_MESSAGE = "event: resync\ndata: {}\n\n"
+
+
+class EventBroadcaster:
+    """接続中のダッシュボードに変更イベントを配信（Server-Sent Events）
+
+    イベントは同じユーザーのクライアントにのみ配信する。
+    クライアントごとのバッファは上限付きで、溢れた場合はバッファを破棄して
+    再取得（resync）を促すため、遅いクライアントがメモリを占有し続けることはない。
+    """
+
+    def __init__(self, buffer_size: int):
+        self._buffer_size = buffer_size
+        self._subscribers: dict[int, set[asyncio.Queue[str]]] = {}
+
+    def has_subscribers(self, user_id: int) -> bool:
+        return bool(self._subscribers.get(user_id))
+
+    def subscribe(self, user_id: int) -> asyncio.Queue[str]:
+        queue: asyncio.Queue[str] = asyncio.Queue(maxsize=self._buffer_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue[str]) -> None:
+        queues = self._subscribers.get(user_id, set())
+        queues.discard(queue)
+        if not queues:
+            self._subscribers.pop(user_id, None)
+
+    def publish(self, user_id: int, event: str, data: dict) -> None:
+        """ユーザーのクライアントにイベントを送信"""
+        message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        for queue in self._subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC_MESSAGE)
+
+
+# Singleton instance
+event_broadcaster = EventBroadcaster(buffer_size=settings.sse_buffer_size)
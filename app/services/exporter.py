@@ -0,0 +1,125 @@
+import io
+from collections.abc import AsyncIterator
+from datetime import datetime
+
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from app.models.database import MealLog, read_session
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pip install ".[export]"
+    pa = None
+
+# 1回にDBから読み込んでファイルに書き出す行数（メモリ使用量の上限になる）
+EXPORT_BATCH_SIZE = 5000
+
+EXPORT_COLUMNS = [
+    "id",
+    "date",
+    "created_at",
+    "protein",
+    "fat",
+    "carbs",
+    "calories",
+    "meal_description",
+    "ai_comment",
+    "caption",
+    "mode",
+    "instagram_post_id",
+]
+
+
+def export_available() -> bool:
+    """エクスポートに必要なpyarrowがインストールされているか"""
+    return pa is not None
+
+
+def _export_schema() -> "pa.Schema":
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("date", pa.timestamp("us")),
+            ("created_at", pa.timestamp("us")),
+            ("protein", pa.float64()),
+            ("fat", pa.float64()),
+            ("carbs", pa.float64()),
+            ("calories", pa.float64()),
+            ("meal_description", pa.string()),
+            ("ai_comment", pa.string()),
+            ("caption", pa.string()),
+            ("mode", pa.string()),
+            ("instagram_post_id", pa.string()),
+        ]
+    )
+
+
+class _ChunkSink(io.RawIOBase):
+    """書き出されたバイト列を溜めておき、バッチごとに取り出すための出力先"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_meal_logs(
+    user_id: int,
+    file_format: str,
+    start_date: datetime | None = None,
+    end_date: datetime | None = None,
+) -> AsyncIterator[bytes]:
+    """ユーザーの食事ログをParquet / Arrow IPC形式でバッチごとに書き出す
+
+    DBカーソルから EXPORT_BATCH_SIZE 行ずつ読み込むため、メモリ使用量は行数に依存しない。
+    """
+    schema = _export_schema()
+    sink = _ChunkSink()
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    query = (
+        select(*[getattr(MealLog, name) for name in EXPORT_COLUMNS])
+        .where(MealLog.user_id == user_id)
+        .order_by(MealLog.id)
+    )
+    if start_date:
+        query = query.where(MealLog.date >= start_date)
+    if end_date:
+        query = query.where(MealLog.date <= end_date)
+
+    try:
+        async with read_session() as session:
+            result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for rows in result.partitions():
+                columns = list(zip(*rows))
+                batch = pa.RecordBatch.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema,
+                )
+                # エンコード・圧縮はイベントループを止めないようスレッドで行う
+                await run_in_threadpool(writer.write_batch, batch)
+                yield sink.drain()
+    finally:
+        writer.close()
+
+    yield sink.drain()
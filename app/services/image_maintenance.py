@@ -0,0 +1,180 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+from sqlalchemy import select, update
+
+from app.config import settings
+from app.models.database import Meal, MealLog, ScheduledPost, read_session, write_queue
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".avif"}
+THUMBNAILS_DIR = settings.images_dir / "thumbs"
+
+# バックグラウンドの画像処理はリクエスト処理と競合しないよう専用の1スレッドで行う
+# （リクエスト中のサムネイル作成は変換待ちにならないよう別スレッドで行う）
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-maintenance")
+
+
+def _thumbnail_path(image_path: Path) -> Path:
+    return THUMBNAILS_DIR / f"{image_path.stem}.webp"
+
+
+def _make_thumbnail(image_path: Path) -> Path | None:
+    """サムネイルを作成（作成済みの場合はそのまま返す）"""
+    thumbnail_path = _thumbnail_path(image_path)
+    if thumbnail_path.exists():
+        return thumbnail_path
+    if not image_path.exists():
+        return None
+
+    THUMBNAILS_DIR.mkdir(parents=True, exist_ok=True)
+    # メンテナンスとリクエストが同時に作成しても一時ファイルが衝突しないようにする
+    temp_path = thumbnail_path.with_name(f"{thumbnail_path.stem}.{threading.get_ident()}.tmp")
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((settings.thumbnail_size, settings.thumbnail_size))
+        image.save(temp_path, format="WEBP", quality=70)
+    os.replace(temp_path, thumbnail_path)
+    return thumbnail_path
+
+
+def _transcode(image_path: Path) -> Path:
+    """画像を設定の形式・画質に変換（元の画像は呼び出し側で削除する）"""
+    image_format = settings.image_transcode_format.upper()
+    new_path = image_path.with_suffix(f".{image_format.lower()}")
+    temp_path = new_path.with_suffix(".tmp")
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.save(temp_path, format=image_format, quality=settings.image_transcode_quality)
+    os.replace(temp_path, new_path)
+    return new_path
+
+
+def _list_images() -> list[tuple[Path, os.stat_result]]:
+    """保存済みの画像（サムネイルを除く）を列挙"""
+    return [
+        (path, path.stat())
+        for path in settings.images_dir.iterdir()
+        if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES
+    ]
+
+
+def _directory_size(directory: Path) -> int:
+    if not directory.exists():
+        return 0
+    return sum(path.stat().st_size for path in directory.iterdir() if path.is_file())
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def _replace_image_path(old_path: Path, new_path: Path | None) -> None:
+    """画像パスの参照を1トランザクションで更新"""
+    new_value = str(new_path) if new_path else None
+
+    async def job(session):
+        await session.execute(
+            update(MealLog).where(MealLog.image_path == str(old_path)).values(image_path=new_value)
+        )
+        await session.execute(
+            update(Meal).where(Meal.image_path == str(old_path)).values(image_path=new_value)
+        )
+
+    await write_queue.submit(job)
+
+
+async def _set_thumbnail_path(image_path: Path, thumbnail_path: Path) -> None:
+    async def job(session):
+        await session.execute(
+            update(MealLog)
+            .where(MealLog.image_path == str(image_path), MealLog.thumbnail_path.is_(None))
+            .values(thumbnail_path=str(thumbnail_path))
+        )
+
+    await write_queue.submit(job)
+
+
+async def ensure_thumbnail(meal_log: MealLog) -> Path | None:
+    """食事ログのサムネイルを取得（なければ作成）"""
+    if meal_log.thumbnail_path and Path(meal_log.thumbnail_path).exists():
+        return Path(meal_log.thumbnail_path)
+    if not meal_log.image_path:
+        return None
+
+    image_path = Path(meal_log.image_path)
+    thumbnail_path = await asyncio.to_thread(_make_thumbnail, image_path)
+    if thumbnail_path is not None:
+        await _set_thumbnail_path(image_path, thumbnail_path)
+    return thumbnail_path
+
+
+async def run_image_maintenance() -> None:
+    """サムネイル作成、古い画像の変換、容量超過分の削除を行う"""
+    cutoff = time.time() - settings.image_transcode_after_days * 86400
+    target_suffix = f".{settings.image_transcode_format.lower()}"
+
+    for image_path, stat in await _run(_list_images):
+        try:
+            thumbnail_path = await _run(_make_thumbnail, image_path)
+            if thumbnail_path is not None:
+                await _set_thumbnail_path(image_path, thumbnail_path)
+
+            if stat.st_mtime < cutoff and image_path.suffix.lower() != target_suffix:
+                new_path = await _run(_transcode, image_path)
+                # 参照を新しい画像に切り替えてから元の画像を削除
+                await _replace_image_path(image_path, new_path)
+                await _run(image_path.unlink)
+        except Exception as e:
+            print(f"Image maintenance skipped {image_path}: {type(e).__name__}: {e}")
+
+        await asyncio.sleep(settings.image_maintenance_throttle)
+
+    await _enforce_quota()
+
+
+async def _scheduled_image_paths() -> set[str]:
+    """未投稿の予約が投稿する画像"""
+    async with read_session() as session:
+        result = await session.execute(
+            select(MealLog.image_path)
+            .join(ScheduledPost, ScheduledPost.meal_log_id == MealLog.id)
+            .where(ScheduledPost.status.in_(("pending", "posting")))
+        )
+        return {path for path in result.scalars() if path}
+
+
+async def _enforce_quota() -> None:
+    """容量の上限を超えた場合、最近使われていない元画像から削除（予約投稿の画像は残す）"""
+    quota = settings.images_quota_mb * 1024 * 1024
+    images = await _run(_list_images)
+    total = sum(stat.st_size for _, stat in images) + await _run(_directory_size, THUMBNAILS_DIR)
+    if total <= quota:
+        return
+
+    scheduled = await _scheduled_image_paths()
+    images.sort(key=lambda item: max(item[1].st_atime, item[1].st_mtime))
+    for image_path, stat in images:
+        if total <= quota:
+            break
+        if str(image_path) in scheduled:
+            continue
+        # サムネイルは残し、元画像への参照を外してから削除
+        await _replace_image_path(image_path, None)
+        await _run(image_path.unlink)
+        total -= stat.st_size
+        print(f"Evicted image to stay within quota: {image_path}")
+
+
+async def image_maintenance_loop() -> None:
+    """画像メンテナンスを定期実行"""
+    while True:
+        try:
+            await run_image_maintenance()
+        except Exception as e:
+            print(f"Image maintenance failed: {type(e).__name__}: {e}")
+        await asyncio.sleep(settings.image_maintenance_interval)
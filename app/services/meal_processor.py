@@ -1,19 +1,26 @@
 import base64
-from datetime import datetime
+import hashlib
+import uuid
+from datetime import datetime, time, timedelta
 from pathlib import Path
 
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.models.database import MealLog
+from app.models.database import Meal, MealLog, ScheduledPost, read_session, write_queue
 from app.models.schemas import DailyMealInput, MealInput, PFCData, PostResult
-from app.services.instagram_service import instagram_service
+from app.services.event_broadcaster import event_broadcaster
 from app.services.openai_service import (
     analyze_meal_from_image,
     analyze_meal_from_text,
+    analyze_meals_batch,
     generate_caption,
     generate_placeholder_image,
+    track_usage,
 )
+from app.services.post_scheduler import post_scheduler, schedule_post
+from app.services.users import can_post_to_instagram
 
 
 async def process_single_meal(meal: MealInput) -> PFCData:
@@ -28,124 +35,490 @@ async def process_single_meal(meal: MealInput) -> PFCData:
         raise ValueError("食事の写真または説明が必要です")
 
 
-async def process_daily_meals(daily_input: DailyMealInput) -> PFCData:
-    """1日分の食事を処理して合計PFCを計算"""
-    # Simple mode: total_description only
-    if daily_input.total_description:
-        return await analyze_meal_from_text(daily_input.total_description)
+async def process_meals(meals: list[MealInput]) -> list[PFCData]:
+    """複数の食事を処理して食事ごとのPFCを計算
+
+    写真を含む食事が複数ある場合は1回のVision APIリクエストにまとめ、
+    レスポンスが不正な場合は食事ごとの分析にフォールバックする。
+    """
+    if len(meals) > 1 and any(meal.has_image() for meal in meals):
+        if any(not meal.has_image() and not meal.description for meal in meals):
+            raise ValueError("食事の写真または説明が必要です")
+        try:
+            return await analyze_meals_batch(meals)
+        except ValueError as e:
+            print(f"Batch analysis failed: {e}, falling back to per-meal analysis...")
+
+    return [await process_single_meal(meal) for meal in meals]
 
-    # Process each meal and sum up
-    if not daily_input.meals:
-        raise ValueError("食事情報がありません")
 
-    total_pfc = PFCData(protein=0, fat=0, carbs=0, calories=0, comment="")
-    comments = []
+def _meal_cache_key(
+    meal_type: str | None, description: str | None, image_data: bytes | None
+) -> str:
+    """分析結果を再利用するためのキーを計算"""
+    digest = hashlib.sha256()
+    digest.update((meal_type or "").encode("utf-8") + b"\0")
+    digest.update((description or "").encode("utf-8") + b"\0")
+    if image_data:
+        digest.update(image_data)
+    return digest.hexdigest()
 
-    for meal in daily_input.meals:
-        pfc = await process_single_meal(meal)
-        total_pfc.protein += pfc.protein
-        total_pfc.fat += pfc.fat
-        total_pfc.carbs += pfc.carbs
-        total_pfc.calories += pfc.calories
-        if pfc.comment:
-            comments.append(pfc.comment)
 
-    # Round values
-    total_pfc.protein = round(total_pfc.protein, 1)
-    total_pfc.fat = round(total_pfc.fat, 1)
-    total_pfc.carbs = round(total_pfc.carbs, 1)
-    total_pfc.calories = round(total_pfc.calories, 0)
+def _save_image(image_data: bytes, name: str) -> Path:
+    """画像をローカルに保存"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    image_path = settings.images_dir / f"{name}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
+    image_path.write_bytes(image_data)
+    return image_path
 
-    # Combine comments
-    if comments:
-        total_pfc.comment = comments[-1]  # Use last comment
 
-    return total_pfc
+def _day_totals(meals: list[Meal]) -> dict:
+    """食事一覧から日別合計を計算（丸めは合計してから1回だけ行う）"""
+    return {
+        "protein": round(sum(m.protein for m in meals), 1),
+        "fat": round(sum(m.fat for m in meals), 1),
+        "carbs": round(sum(m.carbs for m in meals), 1),
+        "calories": round(sum(m.calories for m in meals), 0),
+    }
 
 
-async def create_and_post(
-    daily_input: DailyMealInput, session: AsyncSession, auto_post: bool = True
-) -> PostResult:
-    """食事を処理して投稿まで行う"""
+def _day_description(meals: list[Meal]) -> str | None:
+    descriptions = [m.description for m in meals if m.description]
+    return "、".join(descriptions) if descriptions else None
+
+
+def _day_photo(meals: list[Meal]) -> Meal | None:
+    """その日の最初の写真（ファイルが残っているもの）"""
+    return next((m for m in meals if m.image_path and Path(m.image_path).exists()), None)
+
+
+async def build_meals(
+    user_id: int,
+    meals: list[MealInput],
+    meal_types: list[str | None],
+    skip_keys: set[str] | None = None,
+) -> list[Meal]:
+    """食事ごとにPFCを計算してMealを作成
+
+    skip_keys に含まれる食事（その日に記録済み）は除外し、
+    同じユーザーが過去に分析済みの食事は分析結果を再利用して、新しい食事だけをAIで分析する。
+    """
+    skip_keys = set(skip_keys or ())
+    pending = []
+    for meal, meal_type in zip(meals, meal_types):
+        image_data = base64.b64decode(meal.image_base64) if meal.has_image() else None
+        cache_key = _meal_cache_key(meal_type, meal.description, image_data)
+        if cache_key in skip_keys:
+            continue
+        skip_keys.add(cache_key)
+        pending.append((meal, meal_type, image_data, cache_key))
+
+    if not pending:
+        return []
+
+    # 分析済みの結果を取得
+    async with read_session() as session:
+        result = await session.execute(
+            select(Meal)
+            .join(MealLog, Meal.meal_log_id == MealLog.id)
+            .where(MealLog.user_id == user_id, Meal.cache_key.in_([item[3] for item in pending]))
+        )
+        analyzed = {
+            row.cache_key: PFCData(
+                protein=row.protein,
+                fat=row.fat,
+                carbs=row.carbs,
+                calories=row.calories,
+                comment=row.comment or "",
+            )
+            for row in result.scalars()
+        }
+
+    # 未分析の食事だけをAIで分析
+    to_analyze = [item for item in pending if item[3] not in analyzed]
+    if to_analyze:
+        pfcs = await process_meals([item[0] for item in to_analyze])
+        for item, pfc in zip(to_analyze, pfcs):
+            analyzed[item[3]] = pfc
+
+    new_meals = []
+    for meal, meal_type, image_data, cache_key in pending:
+        pfc = analyzed[cache_key]
+        image_path = _save_image(image_data, f"meal_{meal_type}") if image_data else None
+        new_meals.append(
+            Meal(
+                meal_type=meal_type,
+                description=meal.description,
+                image_path=str(image_path) if image_path else None,
+                protein=pfc.protein,
+                fat=pfc.fat,
+                carbs=pfc.carbs,
+                calories=pfc.calories,
+                comment=pfc.comment,
+                cache_key=cache_key,
+            )
+        )
+    return new_meals
+
+
+async def find_daily_log(session: AsyncSession, user_id: int, date: datetime) -> MealLog | None:
+    """指定日の記録を取得"""
+    start = datetime.combine(date.date(), time.min)
+    result = await session.execute(
+        select(MealLog)
+        .where(
+            MealLog.user_id == user_id,
+            MealLog.date >= start,
+            MealLog.date < start + timedelta(days=1),
+        )
+        .order_by(MealLog.id.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def get_or_create_daily_log(session: AsyncSession, user_id: int, date: datetime) -> MealLog:
+    """指定日の記録を取得（なければ作成）"""
+    meal_log = await find_daily_log(session, user_id, date)
+    if meal_log is None:
+        meal_log = MealLog(
+            user_id=user_id, date=date, protein=0, fat=0, carbs=0, calories=0, mode="text_only"
+        )
+        session.add(meal_log)
+        await session.flush()
+    return meal_log
+
+
+async def get_day_meals(session: AsyncSession, meal_log_id: int) -> list[Meal]:
+    """1日分の食事一覧を取得"""
+    result = await session.execute(
+        select(Meal).where(Meal.meal_log_id == meal_log_id).order_by(Meal.id)
+    )
+    return list(result.scalars().all())
+
+
+async def refresh_daily_log(session: AsyncSession, meal_log: MealLog) -> list[Meal]:
+    """残っている食事から日別の合計・説明・画像を作り直す（write_queue のジョブ内で呼ぶ）
+
+    内容が変わるため、キャプションは次の投稿時に作り直す（None にする）。
+    """
+    await session.flush()
+    meals = await get_day_meals(session, meal_log.id)
+    for column, value in _day_totals(meals).items():
+        setattr(meal_log, column, value)
+    meal_log.meal_description = _day_description(meals)
+    comments = [m.comment for m in meals if m.comment]
+    meal_log.ai_comment = comments[-1] if comments else None
+
+    photo = _day_photo(meals)
+    image_path = photo.image_path if photo else None
+    if image_path != meal_log.image_path:
+        meal_log.image_path = image_path
+        meal_log.thumbnail_path = None
+    meal_log.mode = "photo" if photo else "text_only"
+    meal_log.caption = None
+    return meals
+
+
+async def get_user_meal(
+    session: AsyncSession, user_id: int, meal_id: int
+) -> tuple[Meal, MealLog] | None:
+    """ユーザーの食事と、その日の記録を取得"""
+    result = await session.execute(
+        select(Meal, MealLog)
+        .join(MealLog, Meal.meal_log_id == MealLog.id)
+        .where(Meal.id == meal_id, MealLog.user_id == user_id)
+    )
+    row = result.one_or_none()
+    return (row[0], row[1]) if row is not None else None
+
+
+def meal_log_fields(log: MealLog) -> dict:
+    """MealLogをレスポンス用の値に変換"""
+    return {
+        "id": log.id,
+        "date": log.date.strftime("%Y-%m-%d"),
+        "protein": log.protein,
+        "fat": log.fat,
+        "carbs": log.carbs,
+        "calories": log.calories,
+        "meal_description": log.meal_description,
+        "ai_comment": log.ai_comment,
+        "mode": log.mode or "text_only",
+        "has_image": log.image_path is not None or log.thumbnail_path is not None,
+    }
+
+
+def daily_summary_query(user_id: int):
+    """日別のPFC合計と食事の数を集計するクエリ（過去の記録は起動時に食事として移行済み）"""
+    meals_per_log = (
+        select(func.count(Meal.id)).where(Meal.meal_log_id == MealLog.id).scalar_subquery()
+    )
+    return (
+        select(
+            func.date(MealLog.date).label("date"),
+            func.sum(MealLog.protein).label("total_protein"),
+            func.sum(MealLog.fat).label("total_fat"),
+            func.sum(MealLog.carbs).label("total_carbs"),
+            func.sum(MealLog.calories).label("total_calories"),
+            func.sum(meals_per_log).label("meal_count"),
+        )
+        .where(MealLog.user_id == user_id)
+        .group_by(func.date(MealLog.date))
+    )
 
-    # Check if we have any photos
-    has_photo = any(meal.has_image() for meal in daily_input.meals)
 
-    # Calculate PFC
-    pfc = await process_daily_meals(daily_input)
+def daily_summary_fields(row) -> dict:
+    """集計結果をレスポンス用の値に変換"""
+    return {
+        "date": str(row.date),
+        "total_protein": row.total_protein or 0,
+        "total_fat": row.total_fat or 0,
+        "total_carbs": row.total_carbs or 0,
+        "total_calories": row.total_calories or 0,
+        "meal_count": row.meal_count,
+    }
 
-    # Get description for caption
+
+async def publish_day_update(meal_log: MealLog) -> None:
+    """更新された記録とその日の合計をダッシュボードに通知（書き込みのコミット後に呼ぶ）"""
+    if not event_broadcaster.has_subscribers(meal_log.user_id):
+        return
+
+    event_broadcaster.publish(meal_log.user_id, "meal_log", meal_log_fields(meal_log))
+    async with read_session() as session:
+        result = await session.execute(
+            daily_summary_query(meal_log.user_id).where(
+                func.date(MealLog.date) == meal_log.date.strftime("%Y-%m-%d")
+            )
+        )
+        row = result.one_or_none()
+    if row is not None:
+        event_broadcaster.publish(meal_log.user_id, "day_totals", daily_summary_fields(row))
+
+
+async def add_meal(
+    user_id: int, meal_log_id: int, meal: MealInput
+) -> tuple[MealLog, list[Meal]] | None:
+    """1日分の記録に食事を追加（追加した食事のみ分析）
+
+    更新後の記録と食事一覧を返す（記録が削除されていた場合は None）。
+    """
+    with track_usage() as usage:
+        new_meals = await build_meals(user_id, [meal], [meal.meal_type.value])
+
+    async def job(write_session: AsyncSession):
+        meal_log = await write_session.get(MealLog, meal_log_id)
+        if meal_log is None or meal_log.user_id != user_id:
+            return None
+        for new_meal in new_meals:
+            new_meal.meal_log_id = meal_log.id
+        for record in usage:
+            record.user_id = user_id
+            record.meal_log_id = meal_log.id
+        write_session.add_all(new_meals + usage)
+        if not new_meals:
+            await write_session.flush()
+            return meal_log, await get_day_meals(write_session, meal_log.id)
+        return meal_log, await refresh_daily_log(write_session, meal_log)
+
+    return await _write_day(job)
+
+
+async def update_meal(
+    user_id: int, meal_id: int, meal: MealInput
+) -> tuple[MealLog, list[Meal]] | None:
+    """食事を編集（内容が変わった場合のみ再分析し、日別の記録を作り直す）"""
+    async with read_session() as session:
+        found = await get_user_meal(session, user_id, meal_id)
+    if found is None:
+        return None
+    with track_usage() as usage:
+        new_meals = await build_meals(
+            user_id, [meal], [meal.meal_type.value], skip_keys={found[0].cache_key}
+        )
+
+    async def job(write_session: AsyncSession):
+        found = await get_user_meal(write_session, user_id, meal_id)
+        if found is None:
+            return None
+        meal_row, meal_log = found
+        for record in usage:
+            record.user_id = user_id
+            record.meal_log_id = meal_log.id
+        write_session.add_all(usage)
+        if not new_meals:
+            await write_session.flush()
+            return meal_log, await get_day_meals(write_session, meal_log.id)
+
+        new_meal = new_meals[0]
+        for column in (
+            "meal_type",
+            "description",
+            "image_path",
+            "protein",
+            "fat",
+            "carbs",
+            "calories",
+            "comment",
+            "cache_key",
+        ):
+            setattr(meal_row, column, getattr(new_meal, column))
+        return meal_log, await refresh_daily_log(write_session, meal_log)
+
+    return await _write_day(job)
+
+
+async def remove_meal(user_id: int, meal_id: int) -> tuple[MealLog, list[Meal]] | None:
+    """食事を削除して日別の記録を作り直す"""
+
+    async def job(write_session: AsyncSession):
+        found = await get_user_meal(write_session, user_id, meal_id)
+        if found is None:
+            return None
+        meal_row, meal_log = found
+        await write_session.delete(meal_row)
+        return meal_log, await refresh_daily_log(write_session, meal_log)
+
+    return await _write_day(job)
+
+
+async def _write_day(job) -> tuple[MealLog, list[Meal]] | None:
+    """1日分の記録を更新する書き込みを実行し、コミット後に通知"""
+    result = await write_queue.submit(job)
+    if result is not None:
+        await publish_day_update(result[0])
+    return result
+
+
+async def create_and_post(
+    daily_input: DailyMealInput,
+    user_id: int,
+    auto_post: bool = True,
+    publish_at: datetime | None = None,
+) -> PostResult:
+    """食事を処理して投稿を予約する
+
+    同じ日の記録がある場合はそこに食事を追加し、新しい食事だけを分析して合計を更新する。
+    Instagramへの投稿は予約投稿として登録し、publish_at（省略時は次の空き時刻）に行う。
+    """
+    # Simple mode: total_description only
     if daily_input.total_description:
-        description = daily_input.total_description
-    else:
-        descriptions = [m.description for m in daily_input.meals if m.description]
-        description = "、".join(descriptions) if descriptions else "本日の食事"
-
-    # Generate caption
-    caption = await generate_caption(pfc, description=description, has_photo=has_photo)
-
-    # Prepare image
-    if has_photo:
-        # Use the first photo
-        for meal in daily_input.meals:
-            if meal.has_image():
-                image_data = base64.b64decode(meal.image_base64)
-                mode = "photo"
-                break
+        inputs = [MealInput(description=daily_input.total_description)]
+        meal_types = [None]
+    elif daily_input.meals:
+        inputs = daily_input.meals
+        meal_types = [meal.meal_type.value for meal in inputs]
     else:
-        # Generate placeholder image with DALL-E
-        image_data = await generate_placeholder_image(pfc, description=description)
-        mode = "text_only"
+        raise ValueError("食事情報がありません")
 
-    # Save image locally
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    image_filename = f"meal_{timestamp}.jpg"
-    image_path = settings.images_dir / image_filename
-    image_path.write_bytes(image_data)
+    # 読み取りは短いトランザクションで済ませ、AI処理中は接続を保持しない
+    # （書き込みは最後に write_queue でまとめて行う）
+    async with read_session() as session:
+        existing_log = await find_daily_log(session, user_id, daily_input.date)
+        day_meals = await get_day_meals(session, existing_log.id) if existing_log else []
 
-    # Post to Instagram (only if enabled)
-    post_id = None
-    error = None
+    # API使用量を記録しながらAI処理を行う
+    with track_usage() as usage:
+        # Calculate PFC (only for meals not yet recorded for the day)
+        new_meals = await build_meals(
+            user_id, inputs, meal_types, skip_keys={m.cache_key for m in day_meals}
+        )
+        day_meals += new_meals
 
-    if auto_post and settings.instagram_enabled:
-        try:
-            post_id = await instagram_service.post_photo(image_data, caption)
-        except Exception as e:
-            # Get detailed error message if available
-            detailed_error = instagram_service.get_last_error()
-            error = detailed_error if detailed_error else str(e)
-    elif auto_post and not settings.instagram_enabled:
+        # 新しい食事がなく、投稿内容が作成済みの場合はそのまま使う
+        reuse = (
+            not new_meals
+            and existing_log is not None
+            and existing_log.caption is not None
+            and existing_log.image_path is not None
+            and Path(existing_log.image_path).exists()
+        )
+        if reuse:
+            pfc = PFCData(
+                protein=existing_log.protein,
+                fat=existing_log.fat,
+                carbs=existing_log.carbs,
+                calories=existing_log.calories,
+                comment=existing_log.ai_comment or "",
+            )
+            description = existing_log.meal_description
+            caption = existing_log.caption
+            image_path = Path(existing_log.image_path)
+            image_data = image_path.read_bytes()
+            mode = existing_log.mode
+        else:
+            # 合計値はキャプション用（保存時はその日の食事から計算し直す）
+            comments = [m.comment for m in day_meals if m.comment]
+            pfc = PFCData(**_day_totals(day_meals), comment=comments[-1] if comments else "")
+
+            # Get description for caption
+            description = _day_description(day_meals) or "本日の食事"
+
+            # Use the first photo of the day if any
+            photo_meal = _day_photo(day_meals)
+            has_photo = photo_meal is not None
+
+            # Generate caption
+            caption = await generate_caption(pfc, description=description, has_photo=has_photo)
+
+            # Prepare image
+            if has_photo:
+                image_path = Path(photo_meal.image_path)
+                image_data = image_path.read_bytes()
+                mode = "photo"
+            else:
+                # Generate placeholder image with DALL-E
+                image_data = await generate_placeholder_image(pfc, description=description)
+                image_path = _save_image(image_data, "meal")
+                mode = "text_only"
+
+    # Schedule Instagram post (only if enabled, and only for the default user)
+    schedule = auto_post and can_post_to_instagram(user_id)
+    error = None
+    if auto_post and not schedule:
         error = "Instagram投稿は無効です。手動で投稿してください。"
 
     # Save to database
-    meal_log = MealLog(
-        date=daily_input.date,
-        protein=pfc.protein,
-        fat=pfc.fat,
-        carbs=pfc.carbs,
-        calories=pfc.calories,
-        meal_description=description,
-        ai_comment=pfc.comment,
-        instagram_post_id=post_id,
-        caption=caption,
-        image_path=str(image_path),
-        mode=mode,
-    )
-    session.add(meal_log)
-    await session.commit()
+    async def job(write_session: AsyncSession) -> tuple[MealLog, ScheduledPost | None]:
+        meal_log = await get_or_create_daily_log(write_session, user_id, daily_input.date)
+        if not reuse:
+            for meal in new_meals:
+                meal.meal_log_id = meal_log.id
+            for record in usage:
+                record.user_id = user_id
+                record.meal_log_id = meal_log.id
+            write_session.add_all(new_meals + usage)
+            await refresh_daily_log(write_session, meal_log)
+            meal_log.meal_description = description
+            meal_log.caption = caption
+            if str(image_path) != meal_log.image_path:
+                meal_log.image_path = str(image_path)
+                meal_log.thumbnail_path = None
+            meal_log.mode = mode
+            await write_session.flush()
+        scheduled = None
+        if schedule:
+            scheduled = await schedule_post(write_session, meal_log.id, publish_at)
+        return meal_log, scheduled
 
-    # Success if: posted to Instagram, or auto_post is off, or Instagram is disabled
-    success = post_id is not None or not auto_post or not settings.instagram_enabled
+    meal_log, scheduled = await write_queue.submit(job)
+    if scheduled is not None:
+        post_scheduler.notify(scheduled)
+    if not reuse:
+        await publish_day_update(meal_log)
 
     # Encode image as Base64 for mobile sharing
     image_base64 = base64.b64encode(image_data).decode("utf-8")
 
     return PostResult(
-        success=success,
-        post_id=post_id,
+        success=True,
+        post_id=meal_log.instagram_post_id,
         image_url=str(image_path),
         image_base64=image_base64,
         caption=caption,
         pfc=pfc,
         error=error,
+        scheduled_post_id=scheduled.id if scheduled else None,
+        scheduled_at=scheduled.publish_at if scheduled else None,
     )
@@ -1,14 +1,79 @@
 import base64
 import json
 import re
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 from openai import AsyncOpenAI
 
 from app.config import settings
-from app.models.schemas import PFCData
+from app.models.database import ApiUsage
+from app.models.schemas import MealInput, PFCData
 
 client = AsyncOpenAI(api_key=settings.openai_api_key)
 
+# タスクごとの最大出力トークン数
+MAX_TOKENS_PFC = 200
+MAX_TOKENS_PFC_BATCH_BASE = 100
+MAX_TOKENS_PFC_BATCH_PER_MEAL = 120
+MAX_TOKENS_CAPTION = 300
+
+# モデルごとの料金（USD / 1Mトークン: 入力, キャッシュ済み入力, 出力）
+MODEL_PRICING = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+# DALL-E 3 (standard, 1024x1024) の1枚あたりの料金（USD）
+IMAGE_PRICE_USD = 0.04
+
+_usage_records: ContextVar[list[ApiUsage] | None] = ContextVar("usage_records", default=None)
+
+
+@contextmanager
+def track_usage() -> Iterator[list[ApiUsage]]:
+    """ブロック内のAPI呼び出しの使用量を収集（呼び出し側でDBに保存する）"""
+    records: list[ApiUsage] = []
+    token = _usage_records.set(records)
+    try:
+        yield records
+    finally:
+        _usage_records.reset(token)
+
+
+def _record_usage(task: str, model: str, usage=None) -> None:
+    """API呼び出しの使用量を記録"""
+    records = _usage_records.get()
+    if records is None:
+        return
+
+    if usage is None:
+        records.append(ApiUsage(task=task, model=model, cost_usd=IMAGE_PRICE_USD))
+        return
+
+    prompt_tokens = usage.prompt_tokens or 0
+    completion_tokens = usage.completion_tokens or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+    input_price, cached_price, output_price = MODEL_PRICING.get(model, (0.0, 0.0, 0.0))
+    cost = (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * output_price
+    ) / 1_000_000
+
+    records.append(
+        ApiUsage(
+            task=task,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            cached_tokens=cached_tokens,
+            completion_tokens=completion_tokens,
+            cost_usd=cost,
+        )
+    )
+
 
 SYSTEM_PROMPT_PFC = """あなたは栄養管理の専門家です。
 ユーザーが提供する食事情報からPFC（タンパク質・脂質・炭水化物）とカロリーを推定してください。
@@ -41,8 +106,9 @@ async def analyze_meal_from_text(description: str) -> PFCData:
             },
         ],
         response_format={"type": "json_object"},
-        max_tokens=500,
+        max_tokens=MAX_TOKENS_PFC,
     )
+    _record_usage("pfc", "gpt-4o", response.usage)
 
     result = json.loads(response.choices[0].message.content)
     return PFCData(**result)
@@ -50,16 +116,16 @@ async def analyze_meal_from_text(description: str) -> PFCData:
 
 async def analyze_meal_from_image(image_base64: str, additional_info: str = "") -> PFCData:
     """画像から食事のPFCを分析（Vision API）"""
+    # 固定の指示を先頭に置き、可変の画像・補足情報を後ろに並べる（プロンプトキャッシュ用）
     user_content = [
+        {"type": "text", "text": "この食事写真からPFCとカロリーを推定してください。"},
         {
             "type": "image_url",
             "image_url": {"url": f"data:image/jpeg;base64,{image_base64}", "detail": "high"},
         },
-        {
-            "type": "text",
-            "text": f"この食事写真からPFCとカロリーを推定してください。{additional_info}",
-        },
     ]
+    if additional_info:
+        user_content.append({"type": "text", "text": additional_info})
 
     response = await client.chat.completions.create(
         model="gpt-4o",
@@ -68,88 +134,169 @@ async def analyze_meal_from_image(image_base64: str, additional_info: str = "")
             {"role": "user", "content": user_content},
         ],
         response_format={"type": "json_object"},
-        max_tokens=500,
+        max_tokens=MAX_TOKENS_PFC,
     )
+    _record_usage("pfc", "gpt-4o", response.usage)
 
     result = json.loads(response.choices[0].message.content)
     return PFCData(**result)
 
 
-CAPTION_TEMPLATE_WITH_PHOTO = """以下の情報からInstagram投稿用のキャプションを作成してください。
+SYSTEM_PROMPT_PFC_BATCH = """あなたは栄養管理の専門家です。
+ユーザーが提供する1日分の複数の食事（写真・説明）から、食事ごとにPFC（タンパク質・脂質・炭水化物）とカロリーを推定してください。
 
-PFC情報:
-- タンパク質: {protein}g
-- 脂質: {fat}g
-- 炭水化物: {carbs}g
-- カロリー: {calories}kcal
+必ず以下のJSON形式で、入力された食事と同じ順番・同じ件数で回答してください：
+{
+    "meals": [
+        {
+            "index": <食事番号>,
+            "protein": <数値>,
+            "fat": <数値>,
+            "carbs": <数値>,
+            "calories": <数値>,
+            "comment": "<短いアドバイスやコメント>"
+        }
+    ]
+}
 
-AIコメント: {comment}
+推定のポイント：
+- 一般的な1人前の量を基準に計算
+- 不明な場合は控えめに見積もる
+- commentは励ましやアドバイスを20-30文字程度で
+"""
+
+
+def _parse_batch_response(content: str | None, expected: int) -> list[PFCData]:
+    """一括分析のレスポンスを検証してPFCDataのリストに変換"""
+    # 応答を拒否された場合は content が None になる
+    if not isinstance(content, str):
+        raise ValueError("一括分析の応答が空です")
+    result = json.loads(content)
+    items = result.get("meals") if isinstance(result, dict) else None
+    if (
+        not isinstance(items, list)
+        or len(items) != expected
+        or not all(isinstance(item, dict) for item in items)
+    ):
+        raise ValueError(f"一括分析の件数が一致しません（期待値: {expected}）")
+
+    # indexがあればそれに従って並べ替え
+    if all(isinstance(item.get("index"), int) for item in items):
+        items = sorted(items, key=lambda item: item["index"])
+        if [item["index"] for item in items] != list(range(1, expected + 1)):
+            raise ValueError("一括分析のindexが不正です")
+
+    return [PFCData(**{k: v for k, v in item.items() if k != "index"}) for item in items]
+
+
+async def analyze_meals_batch(meals: list[MealInput]) -> list[PFCData]:
+    """1日分の食事（写真を含む）を1回のVision APIリクエストでまとめて分析
+
+    レスポンスが不正な場合は ValueError（JSONDecodeError / ValidationError を含む）を送出する。
+    """
+    user_content = [
+        {"type": "text", "text": "以下の食事について、それぞれPFCとカロリーを推定してください。"}
+    ]
+    for i, meal in enumerate(meals, start=1):
+        label = f"食事{i}（{meal.meal_type.value}）"
+        if meal.description:
+            label += f": {meal.description}"
+        user_content.append({"type": "text", "text": label})
+        if meal.has_image():
+            user_content.append(
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{meal.image_base64}",
+                        "detail": "high",
+                    },
+                }
+            )
+    user_content.append({"type": "text", "text": f"（全{len(meals)}件）"})
+
+    response = await client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT_PFC_BATCH},
+            {"role": "user", "content": user_content},
+        ],
+        response_format={"type": "json_object"},
+        max_tokens=MAX_TOKENS_PFC_BATCH_BASE + MAX_TOKENS_PFC_BATCH_PER_MEAL * len(meals),
+    )
+    _record_usage("pfc_batch", "gpt-4o", response.usage)
+
+    return _parse_batch_response(response.choices[0].message.content, len(meals))
+
+
+# キャプション生成の指示は固定のsystemプロンプトにまとめ、
+# 可変のPFC情報はuserメッセージとして後ろに渡す（プロンプトキャッシュ用）
+CAPTION_SYSTEM_PROMPT_WITH_PHOTO = """あなたはダイエット記録用Instagramキャプションの作成担当です。
+ユーザーが提供するPFC情報とAIコメントから、キャプションを作成してください。
 
 以下の形式で、改行を含めて出力してください：
 ---
 （食事に関する一言、絵文字OK）
 
-P {protein} / F {fat} / C {carbs} / {calories} kcal
+P <タンパク質> / F <脂質> / C <炭水化物> / <カロリー> kcal
 
-AIコメント：{comment}
+AIコメント：<AIコメント>
 ---
 
 最後にハッシュタグは含めないでください（別途追加します）。
 """
 
-CAPTION_TEMPLATE_NO_PHOTO = """以下の情報からInstagram投稿用のキャプションを作成してください。
+CAPTION_SYSTEM_PROMPT_NO_PHOTO = """あなたはダイエット記録用Instagramキャプションの作成担当です。
 写真が撮れなかった日用の投稿です。
-
-食事内容: {description}
-
-PFC情報:
-- タンパク質: {protein}g
-- 脂質: {fat}g
-- 炭水化物: {carbs}g
-- カロリー: {calories}kcal
-
-AIコメント: {comment}
+ユーザーが提供する食事内容、PFC情報とAIコメントから、キャプションを作成してください。
 
 以下の形式で、改行を含めて出力してください：
 ---
 今日は写真を撮れなかったので、AIで記録だけ残しました
 
-{description}
+<食事内容>
 
-P {protein} / F {fat} / C {carbs} / {calories} kcal
+P <タンパク質> / F <脂質> / C <炭水化物> / <カロリー> kcal
 
-AIコメント：{comment}
+AIコメント：<AIコメント>
 ---
 
 最後にハッシュタグは含めないでください（別途追加します）。
 """
 
+CAPTION_INPUT_TEMPLATE = """PFC情報:
+- タンパク質: {protein}g
+- 脂質: {fat}g
+- 炭水化物: {carbs}g
+- カロリー: {calories}kcal
+
+AIコメント: {comment}
+"""
+
 
 async def generate_caption(pfc: PFCData, description: str = "", has_photo: bool = True) -> str:
     """Instagram用キャプションを生成"""
+    user_prompt = CAPTION_INPUT_TEMPLATE.format(
+        protein=pfc.protein,
+        fat=pfc.fat,
+        carbs=pfc.carbs,
+        calories=pfc.calories,
+        comment=pfc.comment,
+    )
     if has_photo:
-        prompt = CAPTION_TEMPLATE_WITH_PHOTO.format(
-            protein=pfc.protein,
-            fat=pfc.fat,
-            carbs=pfc.carbs,
-            calories=pfc.calories,
-            comment=pfc.comment,
-        )
+        system_prompt = CAPTION_SYSTEM_PROMPT_WITH_PHOTO
     else:
-        prompt = CAPTION_TEMPLATE_NO_PHOTO.format(
-            description=description,
-            protein=pfc.protein,
-            fat=pfc.fat,
-            carbs=pfc.carbs,
-            calories=pfc.calories,
-            comment=pfc.comment,
-        )
+        system_prompt = CAPTION_SYSTEM_PROMPT_NO_PHOTO
+        user_prompt = f"食事内容: {description}\n\n{user_prompt}"
 
     response = await client.chat.completions.create(
         model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=300,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        max_tokens=MAX_TOKENS_CAPTION,
     )
+    _record_usage("caption", "gpt-4o-mini", response.usage)
 
     caption = response.choices[0].message.content.strip()
     # Remove --- markers if present
@@ -195,5 +342,7 @@ async def generate_placeholder_image(pfc: PFCData, description: str = "") -> byt
         response_format="b64_json",
     )
 
+    _record_usage("image", "dall-e-3")
+
     image_b64 = response.data[0].b64_json
     return base64.b64decode(image_b64)
@@ -0,0 +1,287 @@
+import asyncio
+import heapq
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from instagrapi.exceptions import PleaseWaitFewMinutes
+from PIL import Image, ImageOps
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.database import MealLog, ScheduledPost, read_session, write_queue
+from app.services.instagram_service import instagram_service
+from app.services.users import can_post_to_instagram
+
+# instagrapi は同期APIのため、Instagramへのアクセスは専用の1スレッドで行う
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="instagram")
+
+
+def _post_blocking(image_path: Path, caption: str) -> str | None:
+    """画像を投稿（JPEG以外は一時ファイルに変換してから投稿）"""
+    if image_path.suffix.lower() in (".jpg", ".jpeg"):
+        return asyncio.run(instagram_service.post_photo_from_path(image_path, caption))
+
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        temp_path = Path(f.name)
+    try:
+        with Image.open(image_path) as image:
+            ImageOps.exif_transpose(image).convert("RGB").save(temp_path, format="JPEG")
+        return asyncio.run(instagram_service.post_photo_from_path(temp_path, caption))
+    finally:
+        temp_path.unlink()
+
+
+def _local_naive(value: datetime) -> datetime:
+    """タイムゾーン付きの時刻をローカル時刻に変換（DBの時刻はタイムゾーンなしのローカル時刻）"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+async def _next_free_slot(session: AsyncSession) -> datetime:
+    """現在以降で、投稿済み・予約済みのすべての投稿から投稿間隔を空けられる最も早い時刻"""
+    now = datetime.now()
+    interval = timedelta(seconds=settings.instagram_post_interval)
+    result = await session.execute(
+        select(ScheduledPost.posted_at)
+        .where(ScheduledPost.status == "posted", ScheduledPost.posted_at > now - interval)
+        .union_all(
+            select(ScheduledPost.publish_at).where(
+                ScheduledPost.status.in_(("pending", "posting")),
+                ScheduledPost.publish_at > now - interval,
+            )
+        )
+    )
+    slot = now
+    for taken in sorted(result.scalars()):
+        if taken >= slot + interval:
+            break
+        slot = max(slot, taken + interval)
+    return slot
+
+
+async def schedule_post(
+    session: AsyncSession, meal_log_id: int, publish_at: datetime | None = None
+) -> ScheduledPost:
+    """予約投稿を登録（write_queue のジョブ内で呼ぶ）
+
+    publish_at を省略すると、投稿間隔を空けた次の空き時刻に予約する。
+    同じ記録の未投稿の予約がある場合はそれを返す（publish_at を指定した場合は時刻を変更する）。
+    投稿は投稿時点の記録の内容で行われる。
+    """
+    if publish_at is not None:
+        publish_at = _local_naive(publish_at)
+
+    result = await session.execute(
+        select(ScheduledPost).where(
+            ScheduledPost.meal_log_id == meal_log_id, ScheduledPost.status == "pending"
+        )
+    )
+    scheduled = result.scalars().first()
+    if scheduled is not None:
+        if publish_at is not None:
+            scheduled.publish_at = publish_at
+        return scheduled
+
+    if publish_at is None:
+        publish_at = await _next_free_slot(session)
+
+    scheduled = ScheduledPost(meal_log_id=meal_log_id, publish_at=publish_at, status="pending")
+    session.add(scheduled)
+    await session.flush()
+    return scheduled
+
+
+async def cancel_post(user_id: int, scheduled_id: int) -> ScheduledPost | None:
+    """ユーザーの未投稿の予約を取り消す（見つからない場合は None）"""
+
+    async def job(session: AsyncSession) -> ScheduledPost | None:
+        scheduled = await session.scalar(
+            select(ScheduledPost)
+            .join(MealLog, ScheduledPost.meal_log_id == MealLog.id)
+            .where(ScheduledPost.id == scheduled_id, MealLog.user_id == user_id)
+        )
+        if scheduled is not None and scheduled.status == "pending":
+            scheduled.status = "cancelled"
+        return scheduled
+
+    return await write_queue.submit(job)
+
+
+class PostScheduler:
+    """予約投稿を投稿時刻に実行する
+
+    予約は scheduled_posts テーブルに保存し、メモリ上では投稿時刻順のヒープで管理する。
+    直近の予約時刻まで1つのタスクが待機し、より早い予約が追加されたら起こされる。
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[datetime, int]] = []
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def notify(self, scheduled: ScheduledPost) -> None:
+        """登録済みの予約をタイマーに追加"""
+        heapq.heappush(self._heap, (scheduled.publish_at, scheduled.id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        """未投稿の予約を読み込んで開始（再起動前の予約も引き継ぐ）"""
+
+        # 投稿中に停止した予約は、二重投稿を避けるため失敗として扱う
+        async def recover(session: AsyncSession) -> None:
+            await session.execute(
+                update(ScheduledPost)
+                .where(ScheduledPost.status == "posting")
+                .values(status="failed", error="投稿中にサーバーが停止しました")
+            )
+
+        await write_queue.submit(recover)
+        self._heap.clear()
+        self._wakeup = asyncio.Event()
+        async with read_session() as session:
+            result = await session.execute(
+                select(ScheduledPost).where(ScheduledPost.status == "pending")
+            )
+            for scheduled in result.scalars():
+                heapq.heappush(self._heap, (scheduled.publish_at, scheduled.id))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            publish_at, scheduled_id = self._heap[0]
+            try:
+                delay = (publish_at - datetime.now()).total_seconds()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except TimeoutError:
+                        pass
+                    continue
+
+                heapq.heappop(self._heap)
+                await self._publish(scheduled_id)
+            except Exception as e:
+                # 不正な予約があってもタイマーは止めない
+                if self._heap and self._heap[0] == (publish_at, scheduled_id):
+                    heapq.heappop(self._heap)
+                print(f"Scheduled post {scheduled_id} failed: {type(e).__name__}: {e}")
+
+    async def _publish(self, scheduled_id: int) -> None:
+        """予約を投稿（投稿間隔に満たない場合は後ろにずらす）"""
+        async with read_session() as session:
+            scheduled = await session.get(ScheduledPost, scheduled_id)
+            if scheduled is None or scheduled.status != "pending":
+                return
+            # 予約時刻が変更された場合は新しい時刻で待ち直す
+            if scheduled.publish_at > datetime.now():
+                self.notify(scheduled)
+                return
+            last_posted = await session.scalar(
+                select(func.max(ScheduledPost.posted_at)).where(ScheduledPost.status == "posted")
+            )
+            meal_log = await session.get(MealLog, scheduled.meal_log_id)
+
+        if last_posted is not None:
+            next_slot = last_posted + timedelta(seconds=settings.instagram_post_interval)
+            if next_slot > datetime.now():
+                await self._retry(scheduled_id, next_slot, error=None, count_attempt=False)
+                return
+
+        if meal_log is None or not meal_log.image_path or not Path(meal_log.image_path).exists():
+            await self._finish(scheduled_id, status="failed", error="投稿する画像がありません")
+            return
+        if not can_post_to_instagram(meal_log.user_id):
+            await self._finish(scheduled_id, status="failed", error="Instagram投稿は無効です")
+            return
+        if meal_log.caption is None:
+            # 予約後に食事が編集された（もう一度投稿するとキャプションを作り直して予約し直す）
+            await self._finish(
+                scheduled_id, status="failed", error="食事が編集されたため投稿を中止しました"
+            )
+            return
+
+        # 確認後に取り消し・時刻変更がコミットされていた場合は投稿しない
+        async def mark_posting(session: AsyncSession) -> bool:
+            scheduled = await session.get(ScheduledPost, scheduled_id)
+            if scheduled.status != "pending" or scheduled.publish_at > datetime.now():
+                return False
+            scheduled.status = "posting"
+            scheduled.attempts += 1
+            return True
+
+        if not await write_queue.submit(mark_posting):
+            return
+
+        try:
+            post_id = await asyncio.get_running_loop().run_in_executor(
+                _executor, _post_blocking, Path(meal_log.image_path), meal_log.caption
+            )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if str(e) == "Instagram login failed":
+                error = instagram_service.get_last_error() or error
+            delay = settings.instagram_retry_delay
+            if isinstance(e, PleaseWaitFewMinutes):
+                # 投稿が多すぎる場合は間隔を広げて再試行
+                delay = max(delay, settings.instagram_post_interval) * 2
+            await self._retry(scheduled_id, datetime.now() + timedelta(seconds=delay), error=error)
+            return
+
+        await self._finish(scheduled_id, status="posted", post_id=post_id)
+
+    async def _retry(
+        self,
+        scheduled_id: int,
+        publish_at: datetime,
+        error: str | None,
+        count_attempt: bool = True,
+    ) -> None:
+        """予約を後ろにずらす（試行回数の上限に達した場合は失敗）"""
+
+        async def job(session: AsyncSession) -> ScheduledPost:
+            scheduled = await session.get(ScheduledPost, scheduled_id)
+            if count_attempt and scheduled.attempts >= settings.instagram_max_attempts:
+                scheduled.status = "failed"
+            else:
+                scheduled.status = "pending"
+                scheduled.publish_at = publish_at
+            scheduled.error = error
+            return scheduled
+
+        scheduled = await write_queue.submit(job)
+        if scheduled.status == "pending":
+            self.notify(scheduled)
+
+    async def _finish(
+        self, scheduled_id: int, status: str, post_id: str | None = None, error: str | None = None
+    ) -> None:
+        async def job(session: AsyncSession) -> None:
+            scheduled = await session.get(ScheduledPost, scheduled_id)
+            scheduled.status = status
+            scheduled.error = error
+            if post_id is not None:
+                scheduled.post_id = str(post_id)
+                scheduled.posted_at = datetime.now()
+                meal_log = await session.get(MealLog, scheduled.meal_log_id)
+                meal_log.instagram_post_id = str(post_id)
+
+        await write_queue.submit(job)
+
+
+# Singleton instance
+post_scheduler = PostScheduler()
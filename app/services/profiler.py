@@ -0,0 +1,254 @@
+import asyncio
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+
+from app.config import settings
+
+# イベントループが待機中（I/O待ち）とみなすフレーム
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("base_events.py", "_run_once"),
+    ("base_events.py", "run_forever"),
+    ("runners.py", "run"),
+}
+IDLE_LABEL = "(idle: waiting for I/O)"
+OTHER_TASK_LABEL = "(other task: {})"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class RequestProfile:
+    """1リクエスト分のプロファイル（サンプリング結果とタイムライン）"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.timeline: list[dict] = []
+        self.started = time.perf_counter()
+
+    def add_sample(self, frame, other_task: str | None = None) -> None:
+        """スタックを記録（other_task は対象外のタスクを実行中だった場合のタスク名）"""
+        code = frame.f_code
+        if (Path(code.co_filename).name, code.co_name) in _IDLE_FRAMES:
+            label = key = IDLE_LABEL
+        else:
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            label = stack[0]
+            # 同時に処理中の他のリクエストなどは1つの根の下にまとめて区別する
+            if other_task is not None:
+                label = OTHER_TASK_LABEL.format(other_task)
+                stack.append(label)
+            key = ";".join(reversed(stack))
+        self.stacks[key] += 1
+
+        # 同じ処理が続く間は1つの区間にまとめる
+        offset_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        if self.timeline and self.timeline[-1]["label"] == label:
+            self.timeline[-1]["end_ms"] = offset_ms
+        else:
+            self.timeline.append({"start_ms": offset_ms, "end_ms": offset_ms, "label": label})
+
+    def folded(self) -> str:
+        """flamegraph.pl / speedscope で読み込める collapsed stack 形式"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+def _task_name(task: asyncio.Task) -> str:
+    coro_name = getattr(task.get_coro(), "__qualname__", "?")
+    return f"{task.get_name()} {coro_name}"
+
+
+class _Sampler(threading.Thread):
+    """イベントループのスレッドのスタックを一定間隔で採取するスレッド
+
+    採取時にループが実行中のタスクも調べ、プロファイル対象のリクエストのタスク以外の
+    サンプルにはタスク名を付ける。
+    """
+
+    def __init__(self, target_thread_id: int, target_task: asyncio.Task, profile: RequestProfile):
+        super().__init__(name="request-profiler", daemon=True)
+        self._target_thread_id = target_thread_id
+        self._target_task = target_task
+        self._loop = target_task.get_loop()
+        self._profile = profile
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self._profile.interval):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is None:
+                continue
+            task = asyncio.current_task(self._loop)
+            other_task = None
+            if task is not None and task is not self._target_task:
+                other_task = _task_name(task)
+            self._profile.add_sample(frame, other_task)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class LoopLagMonitor:
+    """イベントループの遅延（予定時刻からのずれ）を定期的に計測"""
+
+    def __init__(self, interval: float, history: int):
+        self.interval = interval
+        self.samples: deque[tuple[float, float]] = deque(maxlen=history)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag_ms = max(loop.time() - expected, 0.0) * 1000
+            self.samples.append((time.time(), round(lag_ms, 2)))
+
+    def max_lag_since(self, since: float) -> float:
+        return max((lag for at, lag in self.samples if at >= since), default=0.0)
+
+
+class RequestProfiler:
+    """遅いリクエストの記録と、要求されたリクエストのプロファイリング"""
+
+    def __init__(self):
+        self.records: deque[dict] = deque(maxlen=settings.profile_history_size)
+        self.loop_lag = LoopLagMonitor(
+            interval=settings.loop_lag_interval, history=settings.profile_history_size * 10
+        )
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._active = False
+
+    def should_profile(self, profile_header: str | None) -> bool:
+        """管理者ヘッダー、またはサンプリングレートでプロファイル対象か判定"""
+        if settings.admin_key and profile_header == settings.admin_key:
+            return True
+        return settings.profile_sample_rate > 0 and random.random() < settings.profile_sample_rate
+
+    def start(self) -> tuple[RequestProfile, _Sampler] | None:
+        """プロファイルを開始（同時に1リクエストまで。実行中なら None）"""
+        with self._lock:
+            if self._active:
+                return None
+            self._active = True
+
+        profile = RequestProfile(interval=settings.profile_interval)
+        sampler = _Sampler(threading.get_ident(), asyncio.current_task(), profile)
+        sampler.start()
+        return profile, sampler
+
+    def stop(self, sampler: _Sampler) -> None:
+        sampler.stop()
+        with self._lock:
+            self._active = False
+
+    def record(self, request_info: dict, profile: RequestProfile | None) -> None:
+        """遅いリクエスト、またはプロファイルしたリクエストを保存"""
+        if profile is None and request_info["duration_ms"] < settings.slow_request_threshold_ms:
+            return
+
+        started_at = request_info["started_at"]
+        record = {
+            "id": next(self._ids),
+            **request_info,
+            "started_at": datetime.fromtimestamp(started_at).isoformat(),
+            "max_loop_lag_ms": self.loop_lag.max_lag_since(started_at),
+            "profiled": profile is not None,
+        }
+        if profile is not None:
+            record["sample_count"] = sum(profile.stacks.values())
+            record["sample_interval_ms"] = profile.interval * 1000
+            record["timeline"] = profile.timeline
+            record["folded"] = profile.folded()
+        self.records.append(record)
+
+    def get(self, record_id: int) -> dict | None:
+        return next((r for r in self.records if r["id"] == record_id), None)
+
+
+class ProfilingMiddleware:
+    """リクエストの処理時間を計測し、必要に応じてプロファイルを取るASGIミドルウェア
+
+    プロファイル対象外のリクエストでは処理時間の計測のみ行う。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile_header = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                profile_header = value.decode("latin-1")
+                break
+
+        profiling = None
+        if request_profiler.should_profile(profile_header):
+            profiling = request_profiler.start()
+
+        started_at = time.time()
+        started = time.perf_counter()
+        status_code = 500
+        event_stream = False
+        body_bytes = 0
+        receive_seconds = 0.0
+
+        async def timed_receive():
+            nonlocal body_bytes, receive_seconds
+            receive_started = time.perf_counter()
+            message = await receive()
+            receive_seconds += time.perf_counter() - receive_started
+            body_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status_code, event_stream
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                event_stream = (b"content-type", b"text/event-stream") in [
+                    (name, value.split(b";")[0]) for name, value in message.get("headers", [])
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, timed_receive if profiling else receive, send_wrapper)
+        finally:
+            duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            profile = None
+            if profiling:
+                profile, sampler = profiling
+                request_profiler.stop(sampler)
+            request_info = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status_code,
+                "duration_ms": duration_ms,
+                "started_at": started_at,
+            }
+            if profiling:
+                request_info["body_bytes"] = body_bytes
+                request_info["body_receive_ms"] = round(receive_seconds * 1000, 1)
+            # SSEの接続時間は処理時間ではないため記録しない
+            if not event_stream:
+                request_profiler.record(request_info, profile)
+
+
+# Singleton instance
+request_profiler = RequestProfiler()
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from app.config import settings
+
+
+class AdmissionRejectedError(Exception):
+    """混雑により処理の受付を拒否した"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Server is busy")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """重い処理の同時実行数を制限し、短い待ち行列を超えた分は拒否する"""
+
+    def __init__(
+        self, max_concurrent: int, queue_size: int, queue_timeout: float, retry_after: int
+    ):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._queue_size = queue_size
+        self._queue_timeout = queue_timeout
+        self._retry_after = retry_after
+        self._waiting = 0
+
+    async def acquire(self) -> None:
+        """実行枠を確保（待ち行列が満杯、または待機がタイムアウトした場合は拒否）"""
+        if self._semaphore.locked() and self._waiting >= self._queue_size:
+            raise AdmissionRejectedError(self._retry_after)
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self._queue_timeout)
+        except TimeoutError:
+            raise AdmissionRejectedError(self._retry_after) from None
+        finally:
+            self._waiting -= 1
+
+    def release(self) -> None:
+        """実行枠を解放"""
+        self._semaphore.release()
+
+
+class TokenBucketLimiter:
+    """APIキーごとのトークンバケット"""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self._rate = rate_per_minute / 60.0
+        self._burst = burst
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    def consume(self, key: str) -> float:
+        """トークンを1つ消費。消費できた場合は0、できない場合は補充までの秒数を返す"""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (float(self._burst), now))
+        tokens = min(float(self._burst), tokens + (now - last) * self._rate)
+
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+
+        self._buckets[key] = (tokens, now)
+        if self._rate <= 0:
+            return float(settings.pipeline_retry_after)
+        return (1 - tokens) / self._rate
+
+
+# Singleton instances
+admission_controller = AdmissionController(
+    max_concurrent=settings.max_concurrent_pipelines,
+    queue_size=settings.pipeline_queue_size,
+    queue_timeout=settings.pipeline_queue_timeout,
+    retry_after=settings.pipeline_retry_after,
+)
+rate_limiter = TokenBucketLimiter(
+    rate_per_minute=settings.rate_limit_per_minute,
+    burst=settings.rate_limit_burst,
+)
@@ -0,0 +1,113 @@
+import hashlib
+import secrets
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.database import ApiUsage, MealLog, User, read_session, write_queue
+
+# SECRET_KEY で認証されるユーザー（複数ユーザー化する前の記録の持ち主）
+DEFAULT_USER_NAME = "default"
+
+
+def hash_api_key(api_key: str) -> str:
+    """APIキーのハッシュ（キーはランダムな長い文字列のため、ソルトなしのSHA-256で十分）"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def generate_api_key() -> str:
+    return secrets.token_urlsafe(32)
+
+
+class UserKeyCache:
+    """APIキーのハッシュからユーザーIDを引くキャッシュ（認証のたびにDBを読まない）"""
+
+    def __init__(self):
+        self._user_ids: dict[str, int] = {}
+        self.default_user_id: int | None = None
+
+    async def authenticate(self, api_key: str | None) -> int | None:
+        """APIキーに対応するユーザーIDを返す（無効なキーは None）"""
+        if not api_key:
+            return None
+        key_hash = hash_api_key(api_key)
+        user_id = self._user_ids.get(key_hash)
+        if user_id is None:
+            async with read_session() as session:
+                user_id = await session.scalar(select(User.id).where(User.api_key_hash == key_hash))
+            if user_id is not None:
+                self._user_ids[key_hash] = user_id
+        return user_id
+
+    def invalidate(self, user_id: int) -> None:
+        """キーを変更したユーザーのキャッシュを削除"""
+        self._user_ids = {
+            key_hash: cached_id
+            for key_hash, cached_id in self._user_ids.items()
+            if cached_id != user_id
+        }
+
+
+async def ensure_default_user() -> None:
+    """SECRET_KEY のユーザーを作成・更新し、所有者のない記録を割り当てる"""
+
+    async def job(session: AsyncSession) -> int:
+        user = await session.scalar(select(User).where(User.name == DEFAULT_USER_NAME))
+        if user is None:
+            user = User(name=DEFAULT_USER_NAME, api_key_hash=hash_api_key(settings.secret_key))
+            session.add(user)
+            await session.flush()
+        else:
+            user.api_key_hash = hash_api_key(settings.secret_key)
+        for model in (MealLog, ApiUsage):
+            await session.execute(
+                update(model).where(model.user_id.is_(None)).values(user_id=user.id)
+            )
+        return user.id
+
+    user_id = await write_queue.submit(job)
+    user_key_cache.invalidate(user_id)
+    user_key_cache.default_user_id = user_id
+
+
+def can_post_to_instagram(user_id: int) -> bool:
+    """Instagramに投稿できるか（運営者のアカウントのため default ユーザーのみ）"""
+    return settings.instagram_enabled and user_id == user_key_cache.default_user_id
+
+
+async def create_user(name: str) -> tuple[User, str] | None:
+    """ユーザーを作成してAPIキーを発行（同名のユーザーがいる場合は None）"""
+    api_key = generate_api_key()
+
+    async def job(session: AsyncSession) -> User | None:
+        if await session.scalar(select(User.id).where(User.name == name)) is not None:
+            return None
+        user = User(name=name, api_key_hash=hash_api_key(api_key))
+        session.add(user)
+        await session.flush()
+        return user
+
+    user = await write_queue.submit(job)
+    return (user, api_key) if user is not None else None
+
+
+async def rotate_api_key(user_id: int) -> tuple[User, str] | None:
+    """APIキーを再発行（以前のキーは使えなくなる）"""
+    api_key = generate_api_key()
+
+    async def job(session: AsyncSession) -> User | None:
+        user = await session.get(User, user_id)
+        if user is not None:
+            user.api_key_hash = hash_api_key(api_key)
+        return user
+
+    user = await write_queue.submit(job)
+    if user is None:
+        return None
+    user_key_cache.invalidate(user_id)
+    return user, api_key
+
+
+# Singleton instance
+user_key_cache = UserKeyCache()
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# 設定はインポート時に読み込まれるため、app をインポートする前に環境変数を設定する
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
+os.environ["IMAGES_DIR"] = tempfile.mkdtemp(prefix="diet-app-test-")
+os.environ["IMAGE_MAINTENANCE_ENABLED"] = "false"
+os.environ["INSTAGRAM_ENABLED"] = "false"
@@ -0,0 +1,39 @@
+import httpx
+import pytest
+
+from app.config import settings
+from app.main import app, lifespan
+from app.models.database import _read_only_url, engine, read_engine
+
+
+@pytest.mark.parametrize("url", ["sqlite+aiosqlite:///:memory:", "sqlite+aiosqlite://"])
+def test_in_memory_url_has_no_read_only_pool(url):
+    assert _read_only_url(url) is None
+
+
+def test_file_url_uses_read_only_pool():
+    assert _read_only_url("sqlite+aiosqlite:///./data/diet.db") == (
+        "sqlite+aiosqlite:///file:./data/diet.db?mode=ro&uri=true"
+    )
+
+
+async def test_app_boots_on_in_memory_database():
+    assert read_engine is engine
+    headers = {"X-API-Key": settings.secret_key}
+    async with lifespan(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.get("/api/v1/health")
+            assert response.status_code == 200
+
+            response = await client.get("/")
+            assert response.status_code == 200
+
+            # 起動時に作成された default ユーザーで認証できる
+            response = await client.get("/api/v1/meal/history", headers=headers)
+            assert response.status_code == 200
+            assert response.json() == []
+
+            # 書き込みキューを通る処理
+            response = await client.delete("/api/v1/posts/scheduled/1", headers=headers)
+            assert response.status_code == 404